@@ -1,12 +1,43 @@
 
-import os, re, json, hashlib, sqlite3, base64, math
+import os, re, html, hashlib, sqlite3, base64, math, threading, atexit, functools, logging, queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
+import zstandard as zstd
+import orjson
+import jsonpatch
+
+try:
+    import pybase64 as b64codec  # optional SIMD codec, same API as stdlib base64
+except ImportError:
+    b64codec = base64
+
+try:
+    import xlsxwriter  # noqa: F401  optional faster engine for the Excel export
+    XLSX_ENGINE = "xlsxwriter"
+except ImportError:
+    XLSX_ENGINE = "openpyxl"
+
+try:
+    import pyarrow  # noqa: F401  optional: enables the Parquet pipeline export
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
+
+try:
+    from numba import njit, prange  # optional JIT for the IRR kernels
+except ImportError:
+    njit = None
+    prange = range
 
 # ============================================================
 # AIRE (Proof-of-Concept) v5
@@ -30,40 +61,123 @@ st.set_page_config(page_title="AIRE | AI Underwriting", layout="wide")
 # ----------------------------
 # Utilities
 # ----------------------------
+@st.cache_resource(show_spinner=False)
+def _lru_registry(qualname: str, code_key: str, maxsize: int, _fn):
+    return functools.lru_cache(maxsize=maxsize)(_fn)
+
+def process_lru_cache(maxsize: int = 4096):
+    # functools.lru_cache that outlives a rerun. Streamlit re-executes this module on every rerun, so a plain
+    # @lru_cache would start empty each time; the wrapper is kept in st.cache_resource, keyed by name + bytecode.
+    # Only for pure leaf helpers whose result depends on nothing but their arguments: the cached wrapper keeps
+    # calling the first definition it was given, with that run's module globals. Anything that calls into the rest
+    # of the module belongs in st.cache_data / st.cache_resource, which run the current definition on a miss.
+    def deco(fn):
+        code = fn.__code__
+        code_key = hashlib.sha1(code.co_code + repr(code.co_consts).encode("utf-8")).hexdigest()
+        return _lru_registry(fn.__qualname__, code_key, maxsize, fn)
+    return deco
+
+@st.cache_resource(show_spinner=False)
+def _jit_registry(qualname: str, code_key: str, parallel: bool, _fn):
+    return njit(cache=True, parallel=parallel)(_fn)
+
+def process_njit(fn, parallel: bool = False):
+    # numba.njit compiled once per process (same rerun caveat as process_lru_cache). Without numba the plain
+    # Python function is returned, so callers should only route hot paths through it when njit is available.
+    if njit is None:
+        return fn
+    code = fn.__code__
+    code_key = hashlib.sha1(code.co_code + repr(code.co_consts).encode("utf-8")).hexdigest()
+    return _jit_registry(fn.__qualname__, code_key, parallel, fn)
+
 def now_utc() -> str:
     return datetime.utcnow().isoformat()
 
+_RE_ALPHA = re.compile(r"[^a-zA-Z0-9\s-]")
+_RE_SEP = re.compile(r"[\s_-]+")
+
+@process_lru_cache(maxsize=4096)
 def stable_hash(s: str) -> int:
     h = hashlib.sha256(s.encode("utf-8")).hexdigest()
     return int(h[:8], 16)
 
+@process_lru_cache(maxsize=4096)
 def slugify(text: str) -> str:
-    s = re.sub(r"[^a-zA-Z0-9\s-]", "", (text or "")).strip().lower()
-    s = re.sub(r"[\s_-]+", "-", s)
+    s = _RE_ALPHA.sub("", (text or "")).strip().lower()
+    s = _RE_SEP.sub("-", s)
     return s[:70] if s else "memo"
 
+@process_lru_cache(maxsize=4096)
 def hex_to_rgb01(hx: str):
     hx = (hx or "#2563eb").lstrip("#")
     return tuple(int(hx[i:i+2], 16)/255.0 for i in (0,2,4))
 
+def b64_encode_stream(f, chunk_size: int = 3 * 64 * 1024) -> str:
+    # chunk_size is a multiple of 3, so the per-chunk encodings concatenate without interior padding.
+    parts = [b64codec.b64encode(chunk) for chunk in iter(lambda: f.read(chunk_size), b"")]
+    return b"".join(parts).decode("ascii")
+
 def safe_email(x: str) -> str:
     return (x or "").strip().lower()
 
+@st.cache_resource(show_spinner=False)
+def _invite_key() -> bytes:
+    # Keyed with the INVITE_KEY secret when set; otherwise a random per-process key (codes are stored, never recomputed).
+    secret = _secret("INVITE_KEY")
+    return hashlib.blake2b(secret.encode("utf-8"), digest_size=32).digest() if secret else os.urandom(32)
+
 def gen_invite_code(workspace_id: int, email: str) -> str:
-    raw = f"{workspace_id}|{safe_email(email)}|{now_utc()}|{stable_hash(email)}"
-    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+    raw = f"{workspace_id}|{safe_email(email)}|{now_utc()}"
+    return hashlib.blake2b(raw.encode("utf-8"), key=_invite_key(), digest_size=12).hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    # Shared keep-alive pool: webhook/RESO calls reuse TCP + TLS sessions instead of handshaking per call.
+    # Retry only covers idempotent methods (urllib3 default), so webhook POSTs are never sent twice.
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32,
+                          max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504]))
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+_HTTP = _http_session()
+
+@st.cache_resource(show_spinner=False)
+def _secret(key: str) -> str:
+    try:
+        return str(st.secrets.get(key, "") or "")
+    except Exception:
+        return ""
 
 def post_webhook(url: str, payload: Dict[str, Any]) -> Tuple[bool, str]:
     if not url:
         return False, "No webhook configured."
     try:
-        r = requests.post(url, json=payload, timeout=8)
+        r = _HTTP.post(url, data=_dumps(payload), headers={"Content-Type": "application/json"}, timeout=3)
         if 200 <= r.status_code < 300:
             return True, f"Webhook OK ({r.status_code})"
         return False, f"Webhook failed ({r.status_code})"
     except Exception as e:
         return False, f"Webhook error: {e}"
 
+@st.cache_resource(show_spinner=False)
+def _webhook_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="aire-webhook")
+
+def _log_webhook_result(fut: Future) -> None:
+    ok, msg = fut.result()
+    if not ok:
+        logging.getLogger("aire").warning(msg)
+
+def post_webhook_async(url: str, payload: Dict[str, Any]) -> Optional[Future]:
+    # Fire-and-forget: the rerun returns immediately; a slow partner endpoint only occupies a pool thread.
+    if not url:
+        return None
+    fut = _webhook_pool().submit(post_webhook, url, payload)
+    fut.add_done_callback(_log_webhook_result)
+    return fut
+
 # ----------------------------
 # Theme + Branding
 # ----------------------------
@@ -83,80 +197,47 @@ with st.sidebar:
     st.session_state.brand_accent = st.color_picker("Accent color", value=st.session_state.brand_accent)
     logo = st.file_uploader("Logo (PNG/JPG for memo)", type=["png","jpg","jpeg"])
     if logo:
-        st.session_state.brand_logo_b64 = base64.b64encode(logo.read()).decode("utf-8")
+        # Encode once per upload, not on every rerun.
+        logo_key = (getattr(logo, "file_id", logo.name), logo.size)
+        if st.session_state.get("brand_logo_key") != logo_key:
+            logo.seek(0)
+            st.session_state.brand_logo_b64 = b64_encode_stream(logo)
+            st.session_state.brand_logo_key = logo_key
 
 THEME = st.session_state.theme
 ACCENT = st.session_state.brand_accent
 BRAND = st.session_state.brand_name
 
-if THEME == "Dark":
-    bg = "#0b1220"; card = "#0f172a"; border = "#22314b"; text = "#e5e7eb"; muted = "#cbd5e1"
-else:
-    bg = "#ffffff"; card = "#ffffff"; border = "#e5e7eb"; text = "#0f172a"; muted = "#334155"
-
-st.markdown(f"""
-<style>
-#MainMenu, footer, header {{ visibility: hidden; }}
-html, body, [class*="css"] {{
-  background: {bg} !important;
-  color: {text} !important;
-  font-family: ui-sans-serif, system-ui, -apple-system, Segoe UI, Roboto, "Helvetica Neue", Arial, "Noto Sans", "Liberation Sans", sans-serif !important;
-}}
-a {{ color: {ACCENT} !important; }}
-
-/* App layout */
-.block-container {{ padding-top: 1rem !important; max-width: 1100px; }}
-section[data-testid="stSidebar"] {{ border-right: 1px solid {border} !important; }}
-
-/* Minimal top bar */
-.topbar {{ display:flex; align-items:center; justify-content:space-between; padding: 10px 6px 12px 6px; }}
-.brand {{ font-weight: 900; letter-spacing: 0.2px; font-size: 16px; }}
-.pill {{ border: 1px solid {border}; border-radius: 999px; padding: 7px 12px; background: {card}; color: {muted}; font-size: 12px; }}
-
-/* Surfaces */
-.card {{ border: 1px solid {border}; border-radius: 14px; padding: 16px; background: {card}; }}
-.divider {{ height:1px; background:{border}; margin: 14px 0; }}
-.h1 {{ font-size: 30px; font-weight: 900; line-height: 1.1; margin: 6px 0 6px 0; }}
-.h2 {{ font-size: 16px; font-weight: 800; margin: 0 0 8px 0; color: {text}; }}
-.p {{ color: {muted}; font-size: 14px; line-height: 1.55; }}
-.small {{ font-size: 12px; color: {muted}; }}
-
-/* Chat bubbles */
-/* Action chips */
-.chipRow {{ display:flex; flex-wrap:wrap; gap: 8px; margin-top: 10px; }}
-.chipHint {{ font-size: 11px; color: {muted}; margin-top: 6px; }}
-.chatWrap {{ display:flex; flex-direction:column; gap: 10px; }}
-.bubble {{ max-width: 92%; padding: 12px 14px; border-radius: 14px; border: 1px solid {border}; background: {card}; }}
-.bubble.user {{ margin-left:auto; border-color: rgba(37,99,235,0.28); background: rgba(37,99,235,0.08); }}
-.bubble.assistant {{ margin-right:auto; }}
-.bubble .role {{ font-size: 11px; color: {muted}; margin-bottom: 6px; }}
-.kpiRow {{ display:flex; gap: 10px; flex-wrap: wrap; }}
-.kpi {{ border: 1px solid {border}; border-radius: 12px; padding: 10px 12px; min-width: 160px; background: {card}; }}
-.kpi .label {{ color: {muted}; font-size: 12px; }}
-.kpi .value {{ color: {text}; font-weight: 900; font-size: 16px; margin-top: 2px; }}
-
-/* ChatGPT-like thread list */
-.threadList {{ display:flex; flex-direction:column; gap: 6px; }}
-.threadItem {{ border: 1px solid {border}; border-radius: 12px; padding: 10px 10px; background: {card}; }}
-.threadItem:hover {{ border-color: rgba(37,99,235,0.35); }}
-.threadTop {{ display:flex; align-items:center; justify-content:space-between; gap: 10px; }}
-.threadTitle {{ font-weight: 800; font-size: 12.5px; color: {text}; white-space:nowrap; overflow:hidden; text-overflow:ellipsis; max-width: 220px;}}
-.threadMeta {{ font-size: 11px; color: {muted}; white-space:nowrap; }}
-.threadPreview {{ font-size: 11.5px; color: {muted}; margin-top: 4px; line-height: 1.25; max-height: 2.5em; overflow:hidden; }}
-.pinBtn {{ border: 1px solid {border}; border-radius: 10px; padding: 6px 8px; background: {bg}; color: {muted}; font-size: 12px; }}
-</style>
-""", unsafe_allow_html=True)
-
-st.markdown(f"""<div class="topbar"><div class="brand">{BRAND}</div><div class="pill">Chat Underwriting</div></div>""", unsafe_allow_html=True)
+@st.cache_resource(show_spinner=False)
+def _theme_css_href() -> str:
+    # static/theme.css is served by Streamlit (server.enableStaticServing); the content hash busts browser caches.
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "theme.css")
+    with open(path, "rb") as f:
+        return f"./app/static/theme.css?v={hashlib.sha1(f.read()).hexdigest()[:10]}"
+
+@process_lru_cache(maxsize=64)
+def render_css(theme: str, accent: str, href: str) -> str:
+    # The stylesheet itself is static; only the theme variables travel with each rerun.
+    if theme == "Dark":
+        bg = "#0b1220"; card = "#0f172a"; border = "#22314b"; text = "#e5e7eb"; muted = "#cbd5e1"
+    else:
+        bg = "#ffffff"; card = "#ffffff"; border = "#e5e7eb"; text = "#0f172a"; muted = "#334155"
+    return (f"<style>:root{{--bg:{bg};--card:{card};--border:{border};--text:{text};--muted:{muted};--accent:{accent};}}</style>"
+            f'<link rel="stylesheet" href="{href}">')
+
+@process_lru_cache(maxsize=64)
+def render_topbar(brand: str) -> str:
+    return f"""<div class="topbar"><div class="brand">{brand}</div><div class="pill">Chat Underwriting</div></div>"""
+
+st.markdown(render_css(THEME, ACCENT, _theme_css_href()), unsafe_allow_html=True)
+st.markdown(render_topbar(BRAND), unsafe_allow_html=True)
 # ----------------------------
 # Database
 # ----------------------------
 DB_PATH = "aire.db"
 
-def db_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def _init_schema(conn: sqlite3.Connection) -> None:
     cur = conn.cursor()
-
     cur.execute("""CREATE TABLE IF NOT EXISTS workspaces (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -191,7 +272,7 @@ def db_conn():
     cur.execute("""CREATE TABLE IF NOT EXISTS thread_memory (
         workspace_id INTEGER NOT NULL,
         mem_key TEXT NOT NULL,
-        value_json TEXT NOT NULL,
+        value_json BLOB NOT NULL,
         updated_at TEXT NOT NULL,
         PRIMARY KEY (workspace_id, mem_key)
     )""")
@@ -218,8 +299,27 @@ def db_conn():
         irr_base REAL NOT NULL,
         oer REAL NOT NULL,
         noi REAL NOT NULL,
-        payload TEXT NOT NULL
+        payload BLOB NOT NULL,
+        pinned INTEGER NOT NULL DEFAULT 0,
+        chat_preview TEXT NOT NULL DEFAULT '',
+        search_blob TEXT NOT NULL DEFAULT '',
+        updated_at TEXT NOT NULL DEFAULT ''
     )""")
+    # Thread-list digest columns, kept in step with the payload by save_deal/update_deal_latest so the sidebar never
+    # unpacks payloads, and updated_at, bumped by every write (the thread list's cache watermark). Databases from
+    # before they existed get them added and backfilled once.
+    deal_cols = {row[1] for row in cur.execute("PRAGMA table_info(deals)")}
+    missing = [(c, d) for c, d in (("pinned", "INTEGER NOT NULL DEFAULT 0"), ("chat_preview", "TEXT NOT NULL DEFAULT ''"),
+                                   ("search_blob", "TEXT NOT NULL DEFAULT ''"), ("updated_at", "TEXT NOT NULL DEFAULT ''"))
+               if c not in deal_cols]
+    for col, decl in missing:
+        cur.execute(f"ALTER TABLE deals ADD COLUMN {col} {decl}")
+    if any(c != "updated_at" for c, _ in missing):
+        rows = cur.execute("SELECT id, payload FROM deals").fetchall()
+        cur.executemany("UPDATE deals SET pinned=?, chat_preview=?, search_blob=? WHERE id=?",
+                        [(*_deal_digest(_unpack(payload)), deal_id) for deal_id, payload in rows])
+    if any(c == "updated_at" for c, _ in missing):
+        cur.execute("UPDATE deals SET updated_at=created_at")
     cur.execute("""CREATE TABLE IF NOT EXISTS deal_versions (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         workspace_id INTEGER NOT NULL,
@@ -232,7 +332,7 @@ def db_conn():
         irr_base REAL NOT NULL,
         oer REAL NOT NULL,
         noi REAL NOT NULL,
-        payload TEXT NOT NULL,
+        payload BLOB NOT NULL,
         UNIQUE(workspace_id, deal_id, version_num)
     )""")
     cur.execute("""CREATE TABLE IF NOT EXISTS deal_notes (
@@ -252,7 +352,7 @@ def db_conn():
         slug TEXT NOT NULL,
         brand TEXT NOT NULL,
         accent TEXT NOT NULL,
-        payload TEXT NOT NULL
+        payload BLOB NOT NULL
     )""")
     cur.execute("""CREATE TABLE IF NOT EXISTS calibration (
         workspace_id INTEGER PRIMARY KEY,
@@ -261,136 +361,378 @@ def db_conn():
         oer_bias REAL NOT NULL,
         irr_bias REAL NOT NULL
     )""")
+
+    # Every list/lookup is scoped by workspace_id; these match the WHERE + ORDER BY of the hot queries.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deals_ws_folder_id ON deals(workspace_id, folder, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deals_ws_id ON deals(workspace_id, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deals_ws_pin_id ON deals(workspace_id, pinned DESC, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deals_ws_updated ON deals(workspace_id, updated_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deal_versions_ws_deal_ver ON deal_versions(workspace_id, deal_id, version_num DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_deal_notes_ws_deal_id ON deal_notes(workspace_id, deal_id, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_ws_id ON audit_log(workspace_id, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_memos_ws_slug_id ON memos(workspace_id, slug, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_ws_email ON users(workspace_id, email)")
+    cur.execute("ANALYZE")
     conn.commit()
+
+@st.cache_resource(show_spinner=False)
+def _init_db() -> None:
+    # Schema + journal mode once per process. WAL is persistent in the file: commits append to the log instead of
+    # fsyncing a rollback journal, and readers never block on a writer.
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    _init_schema(conn)
+    conn.close()
+
+# Connections come from a bounded per-process pool: writers via rw_conn(), readers via ro_conn(), each checked out for
+# one `with` block. Every rerun runs on a fresh ScriptRunner thread, so per-thread connections would be reopened (and
+# their PRAGMAs re-run) on nearly every rerun and never closed. WAL + busy_timeout arbitrates between the writers.
+_POOL_SIZE = 8
+
+def _connect_rw() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA busy_timeout=5000")
     return conn
 
-CONN = db_conn()
+def _connect_ro() -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+@st.cache_resource(show_spinner=False)
+def _conn_pool() -> Dict[str, queue.LifoQueue]:
+    # One slot per connection; a slot holds None until first use, so connections are opened lazily. LIFO keeps the
+    # warm connections in use. get() blocks once all _POOL_SIZE connections of a kind are checked out.
+    pools = {"rw": queue.LifoQueue(maxsize=_POOL_SIZE), "ro": queue.LifoQueue(maxsize=_POOL_SIZE)}
+    for pool in pools.values():
+        for _ in range(_POOL_SIZE):
+            pool.put(None)
+    return pools
+
+_POOL = _conn_pool()
+
+@contextmanager
+def _checkout(kind: str, connect):
+    pool = _POOL[kind]
+    conn = pool.get()
+    try:
+        if conn is None:
+            conn = connect()
+        yield conn
+    finally:
+        if conn is not None and conn.in_transaction:
+            conn.rollback()  # never hand the next caller someone else's open transaction
+        pool.put(conn)
+
+@contextmanager
+def rw_conn():
+    # Inside tx() this is the transaction's connection, so every write lands in the same BEGIN ... COMMIT.
+    conn = getattr(_TX, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    with _checkout("rw", _connect_rw) as conn:
+        yield conn
+
+def ro_conn():
+    return _checkout("ro", _connect_ro)
 
 # ----------------------------
 # Data access
 # ----------------------------
-def audit(workspace_id: int, actor_email: str, action: str, target_type: Optional[str]=None, target_id: Optional[int]=None, meta: Optional[Dict[str, Any]]=None):
-    cur = CONN.cursor()
-    cur.execute("""INSERT INTO audit_log (workspace_id, actor_email, action, target_type, target_id, meta, created_at)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (workspace_id, safe_email(actor_email), action, target_type, target_id, json.dumps(meta or {}), now_utc()))
-    CONN.commit()
+_JSON_OPTS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _dumps(obj: Any) -> bytes:
+    # numpy scalars/arrays leak into payloads from the model code; serialize them natively.
+    return orjson.dumps(obj, option=_JSON_OPTS)
+
+def _loads(val: Union[str, bytes]) -> Any:
+    return orjson.loads(val)
+
+# zstd contexts aren't thread-safe but are costly to set up per call; keep one pair per thread.
+@st.cache_resource(show_spinner=False)
+def _zstd_local() -> threading.local:
+    return threading.local()
+
+_ZSTD = _zstd_local()
+
+def _zstd_pair() -> Tuple[Any, Any]:
+    pair = getattr(_ZSTD, "pair", None)
+    if pair is None:
+        pair = (zstd.ZstdCompressor(level=3), zstd.ZstdDecompressor())
+        _ZSTD.pair = pair
+    return pair
+
+def _pack(obj: Any) -> bytes:
+    # Large JSON documents (deal/version/memo payloads, thread memory) are stored zstd-compressed as BLOBs.
+    return _zstd_pair()[0].compress(_dumps(obj))
+
+def _unpack(val: Any) -> Any:
+    # Rows written before compression are plain JSON TEXT; read both.
+    if isinstance(val, (bytes, memoryview)):
+        return _loads(_zstd_pair()[1].decompress(val))
+    return _loads(val)
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def _unpack_shared(val: Union[bytes, str]) -> Any:
+    # _unpack keyed on the stored bytes themselves: a rewritten row is a new key, so nothing needs invalidating.
+    # The result is shared across reruns and sessions; callers copy whatever they go on to modify.
+    return _unpack(val)
+
+def _deal_digest(payload: Dict[str, Any]) -> Tuple[int, str, str]:
+    # (pinned, chat_preview, search_blob) for the deals row: what the thread list shows and searches.
+    memo = (payload or {}).get("memo") or {}
+    chat = memo.get("chat") or []
+    last = str(chat[-1].get("content", "") or "") if chat else ""
+    preview = " ".join(last.split())[:120]
+    address = str((memo.get("deal") or {}).get("address", "") or "")
+    blob = " ".join([address] + [str(msg.get("content", "") or "") for msg in chat]).lower()
+    return int(bool(memo.get("pinned"))), preview, blob
+
+_init_db()
+
+_TX = threading.local()
+
+@contextmanager
+def tx():
+    # One BEGIN IMMEDIATE ... COMMIT (one fsync) around several writes. The writer is held for the whole block and
+    # rw_conn() hands it to every write inside; nested use joins the outer transaction.
+    conn = getattr(_TX, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+    with _checkout("rw", _connect_rw) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _TX.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _TX.conn = None
+
+def _in_tx() -> bool:
+    return getattr(_TX, "conn", None) is not None
+
+def _commit(conn: sqlite3.Connection) -> None:
+    # Writers call this instead of conn.commit() so they batch correctly inside tx().
+    if not _in_tx():
+        conn.commit()
+
+_AUDIT_SQL = """INSERT INTO audit_log (workspace_id, actor_email, action, target_type, target_id, meta, created_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?)"""
+_AUDIT_FLUSH_ROWS = 32
+_AUDIT_FLUSH_AGE_S = 0.5
+def flush_audit() -> None:
+    # Writes its own transaction; inside someone else's tx() the rows wait for the timer instead of riding (and
+    # possibly rolling back) with that unrelated transaction.
+    if _in_tx():
+        return
+    with _AUDIT["lock"]:
+        _AUDIT["timer"] = None   # cleared before draining, so a row queued from here on arms a new timer
+    rows = []
+    while _audit_buffer:
+        rows.append(_audit_buffer.popleft())
+    if rows:
+        try:
+            with tx() as conn:
+                conn.executemany(_AUDIT_SQL, rows)
+        except Exception:
+            # Back at the front, in order, for the next flush; on the timer thread no one else would see them lost.
+            _audit_buffer.extendleft(reversed(rows))
+            _arm_audit_flush()
+            raise
+
+@st.cache_resource(show_spinner=False)
+def _audit_queue() -> Dict[str, Any]:
+    # Process-wide so queued rows survive reruns; the exit hook is registered once, not once per rerun.
+    atexit.register(flush_audit)
+    return {"rows": deque(), "lock": threading.Lock(), "timer": None}
+
+_AUDIT = _audit_queue()
+_audit_buffer: deque = _AUDIT["rows"]
+
+def _arm_audit_flush() -> None:
+    # At most one pending timer: queued rows reach the database within _AUDIT_FLUSH_AGE_S even if no one calls
+    # audit() again.
+    with _AUDIT["lock"]:
+        if _AUDIT["timer"] is None:
+            timer = threading.Timer(_AUDIT_FLUSH_AGE_S, flush_audit)
+            timer.daemon = True
+            _AUDIT["timer"] = timer
+            timer.start()
+
+def audit(workspace_id: int, actor_email: str, action: str, target_type: Optional[str]=None, target_id: Optional[int]=None, meta: Optional[Dict[str, Any]]=None,
+          sync: bool=False, ts: Optional[str]=None):
+    # Buffered: rows are written in one executemany/commit. Inside tx() the row is inserted with (and commits or
+    # rolls back with) the caller's writes; sync=True writes the queue now.
+    row = (workspace_id, safe_email(actor_email), action, target_type, target_id, _dumps(meta or {}).decode(), ts or now_utc())
+    if _in_tx():
+        _TX.conn.execute(_AUDIT_SQL, row)
+        return
+    _audit_buffer.append(row)
+    if sync or len(_audit_buffer) >= _AUDIT_FLUSH_ROWS:
+        flush_audit()
+    else:
+        _arm_audit_flush()
 
 def ensure_workspace(name: str) -> int:
-    cur = CONN.cursor()
-    cur.execute("SELECT id FROM workspaces WHERE name=?", (name,))
-    row = cur.fetchone()
-    if row:
-        return int(row[0])
-    cur.execute("INSERT INTO workspaces (name, created_at) VALUES (?, ?)", (name, now_utc()))
-    CONN.commit()
-    return int(cur.lastrowid)
+    with rw_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM workspaces WHERE name=?", (name,))
+        row = cur.fetchone()
+        if row:
+            return int(row[0])
+        cur.execute("INSERT INTO workspaces (name, created_at) VALUES (?, ?)", (name, now_utc()))
+        _commit(conn)
+        return int(cur.lastrowid)
 
 def ensure_user(email: str, workspace_id: int, role: str) -> None:
-    cur = CONN.cursor()
-    cur.execute("INSERT OR IGNORE INTO users (email, workspace_id, role, created_at) VALUES (?, ?, ?, ?)",
-                (safe_email(email), workspace_id, role, now_utc()))
-    CONN.commit()
+    with rw_conn() as conn:
+        conn.execute("INSERT OR IGNORE INTO users (email, workspace_id, role, created_at) VALUES (?, ?, ?, ?)",
+                     (safe_email(email), workspace_id, role, now_utc()))
+        _commit(conn)
 
 def get_user_role(email: str, workspace_id: int) -> str:
-    cur = CONN.cursor()
-    cur.execute("SELECT role FROM users WHERE email=? AND workspace_id=?", (safe_email(email), workspace_id))
-    row = cur.fetchone()
+    with ro_conn() as conn:
+        row = conn.execute("SELECT role FROM users WHERE email=? AND workspace_id=?", (safe_email(email), workspace_id)).fetchone()
     return row[0] if row else "analyst"
 
 def list_users(workspace_id: int) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("SELECT email, role, created_at FROM users WHERE workspace_id=? ORDER BY created_at ASC", (workspace_id,))
-    return pd.DataFrame(cur.fetchall(), columns=["email","role","created_at"])
+    with ro_conn() as conn:
+        return pd.read_sql_query("SELECT email, role, created_at FROM users WHERE workspace_id=? ORDER BY created_at ASC",
+                                 conn, params=(workspace_id,))
 
 def set_user_role(workspace_id: int, email: str, role: str):
-    cur = CONN.cursor()
-    cur.execute("UPDATE users SET role=? WHERE workspace_id=? AND email=?", (role, workspace_id, safe_email(email)))
-    CONN.commit()
+    with rw_conn() as conn:
+        conn.execute("UPDATE users SET role=? WHERE workspace_id=? AND email=?", (role, workspace_id, safe_email(email)))
+        _commit(conn)
 
 def upsert_invite(workspace_id: int, email: str, role: str) -> str:
     code = gen_invite_code(workspace_id, email)
-    cur = CONN.cursor()
-    cur.execute("""INSERT INTO invitations (workspace_id, email, role, code, created_at, accepted_at)
-                   VALUES (?, ?, ?, ?, ?, NULL)
-                   ON CONFLICT(workspace_id, email) DO UPDATE SET
-                     role=excluded.role,
-                     code=excluded.code,
-                     created_at=excluded.created_at,
-                     accepted_at=NULL""",
-                (workspace_id, safe_email(email), role, code, now_utc()))
-    CONN.commit()
+    with rw_conn() as conn:
+        conn.execute("""INSERT INTO invitations (workspace_id, email, role, code, created_at, accepted_at)
+                        VALUES (?, ?, ?, ?, ?, NULL)
+                        ON CONFLICT(workspace_id, email) DO UPDATE SET
+                          role=excluded.role,
+                          code=excluded.code,
+                          created_at=excluded.created_at,
+                          accepted_at=NULL""",
+                     (workspace_id, safe_email(email), role, code, now_utc()))
+        _commit(conn)
     return code
 
 def accept_invite(workspace_id: int, email: str, code: str) -> Tuple[bool, str]:
-    cur = CONN.cursor()
-    cur.execute("SELECT role, code, accepted_at FROM invitations WHERE workspace_id=? AND email=?",
-                (workspace_id, safe_email(email)))
-    row = cur.fetchone()
-    if not row:
-        return False, "No invite found."
-    role, real_code, accepted_at = row
-    if real_code != code:
-        return False, "Invite code mismatch."
-    if accepted_at:
-        return False, "Invite already accepted."
-    ensure_user(email, workspace_id, role)
-    cur.execute("UPDATE invitations SET accepted_at=? WHERE workspace_id=? AND email=?", (now_utc(), workspace_id, safe_email(email)))
-    CONN.commit()
+    with tx() as conn:
+        row = conn.execute("SELECT role, code, accepted_at FROM invitations WHERE workspace_id=? AND email=?",
+                           (workspace_id, safe_email(email))).fetchone()
+        if not row:
+            return False, "No invite found."
+        role, real_code, accepted_at = row
+        if real_code != code:
+            return False, "Invite code mismatch."
+        if accepted_at:
+            return False, "Invite already accepted."
+        ensure_user(email, workspace_id, role)
+        conn.execute("UPDATE invitations SET accepted_at=? WHERE workspace_id=? AND email=?", (now_utc(), workspace_id, safe_email(email)))
     return True, f"Invite accepted. Role: {role.upper()}."
 
 def list_invites(workspace_id: int) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("SELECT email, role, code, created_at, accepted_at FROM invitations WHERE workspace_id=? ORDER BY created_at DESC", (workspace_id,))
-    return pd.DataFrame(cur.fetchall(), columns=["email","role","code","created_at","accepted_at"])
+    with ro_conn() as conn:
+        return pd.read_sql_query("SELECT email, role, code, created_at, accepted_at FROM invitations WHERE workspace_id=? ORDER BY created_at DESC",
+                                 conn, params=(workspace_id,))
 
 def upsert_settings(workspace_id: int, folders: List[str], scoring_profile: str, webhook_url: str):
-    cur = CONN.cursor()
-    cur.execute("""
-        INSERT INTO workspace_settings (workspace_id, created_at, folders_json, scoring_profile, webhook_url)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(workspace_id) DO UPDATE SET
-            created_at=excluded.created_at,
-            folders_json=excluded.folders_json,
-            scoring_profile=excluded.scoring_profile,
-            webhook_url=excluded.webhook_url
-    """, (workspace_id, now_utc(), json.dumps(folders), scoring_profile, webhook_url))
-    CONN.commit()
+    with rw_conn() as conn:
+        conn.execute("""
+            INSERT INTO workspace_settings (workspace_id, created_at, folders_json, scoring_profile, webhook_url)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(workspace_id) DO UPDATE SET
+                created_at=excluded.created_at,
+                folders_json=excluded.folders_json,
+                scoring_profile=excluded.scoring_profile,
+                webhook_url=excluded.webhook_url
+        """, (workspace_id, now_utc(), _dumps(folders).decode(), scoring_profile, webhook_url))
+        _commit(conn)
+    _settings_for.clear()
 
 def get_settings(workspace_id: int) -> Dict[str, Any]:
-    cur = CONN.cursor()
-    cur.execute("SELECT folders_json, scoring_profile, webhook_url FROM workspace_settings WHERE workspace_id=?", (workspace_id,))
-    row = cur.fetchone()
+    with ro_conn() as conn:
+        row = conn.execute("SELECT folders_json, scoring_profile, webhook_url FROM workspace_settings WHERE workspace_id=?",
+                           (workspace_id,)).fetchone()
     if not row:
         default = {"folders": ["Hot","Maybe","Trash"], "scoring_profile": "Core", "webhook_url": ""}
         upsert_settings(workspace_id, default["folders"], default["scoring_profile"], default["webhook_url"])
         return default
-    return {"folders": json.loads(row[0]), "scoring_profile": row[1], "webhook_url": row[2]}
+    return {"folders": _loads(row[0]), "scoring_profile": row[1], "webhook_url": row[2]}
 
+# Read on every rerun (and again by exports/admin); writes go through upsert_settings, which clears this.
+@st.cache_data(ttl=30, max_entries=64, show_spinner=False)
+def _settings_for(workspace_id: int) -> Dict[str, Any]:
+    return get_settings(workspace_id)
 
-def get_thread_memory(workspace_id: int, mem_key: str) -> Dict[str, Any]:
-    conn = db_conn()
-    cur = conn.cursor()
+
+@st.cache_resource(show_spinner=False)
+def _memory_cache() -> Dict[str, Any]:
+    # Parsed thread memory by (workspace_id, mem_key), shared across sessions. "gen" is bumped on every
+    # invalidation so a read that raced a write doesn't put the stale value back.
+    return {"gen": 0, "lock": threading.Lock(), "items": {}}
+
+_MEM_CACHE = _memory_cache()
+
+def _read_thread_memory(cur: sqlite3.Cursor, workspace_id: int, mem_key: str) -> Dict[str, Any]:
     cur.execute("SELECT value_json FROM thread_memory WHERE workspace_id=? AND mem_key=?", (workspace_id, mem_key))
     row = cur.fetchone()
-    conn.close()
     if not row:
         return {}
     try:
-        return json.loads(row[0])
+        return _unpack(row[0])
     except Exception:
         return {}
 
-def upsert_thread_memory(workspace_id: int, mem_key: str, value: Dict[str, Any]) -> None:
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO thread_memory (workspace_id, mem_key, value_json, updated_at) VALUES (?, ?, ?, ?) "
-        "ON CONFLICT(workspace_id, mem_key) DO UPDATE SET value_json=excluded.value_json, updated_at=excluded.updated_at",
-        (workspace_id, mem_key, json.dumps(value), datetime.datetime.utcnow().isoformat())
-    )
-    conn.commit()
-    conn.close()
+def get_thread_memory(workspace_id: int, mem_key: str, conn: Optional[sqlite3.Connection]=None) -> Dict[str, Any]:
+    # Pass the tx() connection to read your own uncommitted writes (bypasses the cache).
+    # Cached values are shared: copy before mutating.
+    if conn is not None:
+        return _read_thread_memory(conn.cursor(), workspace_id, mem_key)
+    key = (workspace_id, mem_key)
+    hit = _MEM_CACHE["items"].get(key)
+    if hit is not None:
+        return hit
+    gen = _MEM_CACHE["gen"]
+    with ro_conn() as conn:
+        val = _read_thread_memory(conn.cursor(), workspace_id, mem_key)
+    with _MEM_CACHE["lock"]:
+        if _MEM_CACHE["gen"] == gen:
+            _MEM_CACHE["items"][key] = val
+    return val
+
+def _invalidate_thread_memory(workspace_id: int, *mem_keys: str) -> None:
+    # Call after the write is committed.
+    with _MEM_CACHE["lock"]:
+        _MEM_CACHE["gen"] += 1
+        for k in mem_keys:
+            _MEM_CACHE["items"].pop((workspace_id, k), None)
+
+def upsert_thread_memory(workspace_id: int, mem_key: str, value: Dict[str, Any], ts: Optional[str]=None) -> None:
+    with rw_conn() as conn:
+        conn.execute(
+            "INSERT INTO thread_memory (workspace_id, mem_key, value_json, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(workspace_id, mem_key) DO UPDATE SET value_json=excluded.value_json, updated_at=excluded.updated_at",
+            (workspace_id, mem_key, _pack(value), ts or now_utc())
+        )
+        _commit(conn)
+    if not _in_tx():
+        _invalidate_thread_memory(workspace_id, mem_key)
 
 def _mem_key_for_deal(deal: Dict[str, Any]) -> str:
     city = (deal or {}).get("city") or ""
@@ -401,6 +743,17 @@ def _mem_key_for_deal(deal: Dict[str, Any]) -> str:
         return f"city:{city.strip().lower()}"
     return "global"
 
+_MEM_KEYS = ("hold_years", "rent_growth", "expense_growth", "exit_cap", "sale_cost_pct",
+             "down_payment_pct", "interest_rate", "amort_years", "vacancy_rate", "expense_ratio")
+
+def _blend(old: Dict[str, Any], new: np.ndarray, alpha: float) -> Dict[str, Any]:
+    # new is ordered like _MEM_KEYS; keys missing from old start at the new value.
+    prev = np.fromiter((old.get(k, np.nan) for k in _MEM_KEYS), dtype=np.float64, count=len(_MEM_KEYS))
+    prev = np.where(np.isnan(prev), new, prev)
+    out = dict(old or {})
+    out.update(zip(_MEM_KEYS, ((1 - alpha) * prev + alpha * new).tolist()))
+    return out
+
 def update_memory_from_memo(workspace_id: int, memo: Dict[str, Any]) -> None:
     if not memo:
         return
@@ -408,42 +761,36 @@ def update_memory_from_memo(workspace_id: int, memo: Dict[str, Any]) -> None:
     mi = memo.get("model_inputs", {}) or {}
     metrics = memo.get("metrics", {}) or {}
 
-    snapshot = {
-        "hold_years": float(mi.get("hold_years", 5)),
-        "rent_growth": float(mi.get("rent_growth", 0.03)),
-        "expense_growth": float(mi.get("expense_growth", 0.025)),
-        "exit_cap": float(mi.get("exit_cap", 0.065)),
-        "sale_cost_pct": float(mi.get("sale_cost_pct", 0.05)),
-        "down_payment_pct": float(mi.get("down_payment_pct", 0.25)),
-        "interest_rate": float(mi.get("interest_rate", 0.065)),
-        "amort_years": float(mi.get("amort_years", 30)),
-        "vacancy_rate": float(deal.get("vacancy_rate", metrics.get("vacancy_rate", 0.08)) if isinstance(deal, dict) else 0.08),
-        "expense_ratio": float(metrics.get("oer", 0.45)),
-    }
-
-    def _blend(old: Dict[str, Any], new: Dict[str, Any], alpha: float) -> Dict[str, Any]:
-        out = dict(old or {})
-        for k, v in (new or {}).items():
-            if isinstance(v, (int, float)) and isinstance(out.get(k), (int, float)):
-                out[k] = (1 - alpha) * float(out[k]) + alpha * float(v)
-            else:
-                out[k] = v
-        return out
-
-    # global
-    g_old = get_thread_memory(workspace_id, "global")
-    g_n = int(g_old.get("n", 0)) + 1
-    g_alpha = 1.0 / min(g_n, 20)
-    g_val = _blend(g_old.get("defaults", {}), snapshot, g_alpha)
-    upsert_thread_memory(workspace_id, "global", {"n": g_n, "defaults": g_val})
-
-    # city
-    key = _mem_key_for_deal(deal)
-    c_old = get_thread_memory(workspace_id, key)
-    c_n = int(c_old.get("n", 0)) + 1
-    c_alpha = 1.0 / min(c_n, 15)
-    c_val = _blend(c_old.get("defaults", {}), snapshot, c_alpha)
-    upsert_thread_memory(workspace_id, key, {"n": c_n, "defaults": c_val})
+    snapshot = np.array([
+        float(mi.get("hold_years", 5)),
+        float(mi.get("rent_growth", 0.03)),
+        float(mi.get("expense_growth", 0.025)),
+        float(mi.get("exit_cap", 0.065)),
+        float(mi.get("sale_cost_pct", 0.05)),
+        float(mi.get("down_payment_pct", 0.25)),
+        float(mi.get("interest_rate", 0.065)),
+        float(mi.get("amort_years", 30)),
+        float(deal.get("vacancy_rate", metrics.get("vacancy_rate", 0.08)) if isinstance(deal, dict) else 0.08),
+        float(metrics.get("oer", 0.45)),
+    ], dtype=np.float64)
+
+    ts = now_utc()
+    with tx() as conn:
+        # global
+        g_old = get_thread_memory(workspace_id, "global", conn=conn)
+        g_n = int(g_old.get("n", 0)) + 1
+        g_alpha = 1.0 / min(g_n, 20)
+        g_val = _blend(g_old.get("defaults", {}), snapshot, g_alpha)
+        upsert_thread_memory(workspace_id, "global", {"n": g_n, "defaults": g_val}, ts=ts)
+
+        # city
+        key = _mem_key_for_deal(deal)
+        c_old = get_thread_memory(workspace_id, key, conn=conn)
+        c_n = int(c_old.get("n", 0)) + 1
+        c_alpha = 1.0 / min(c_n, 15)
+        c_val = _blend(c_old.get("defaults", {}), snapshot, c_alpha)
+        upsert_thread_memory(workspace_id, key, {"n": c_n, "defaults": c_val}, ts=ts)
+    _invalidate_thread_memory(workspace_id, "global", key)
 
 def apply_memory_defaults(workspace_id: int, deal: Dict[str, Any], mi: Dict[str, Any]) -> Dict[str, Any]:
     out = dict(mi or {})
@@ -458,144 +805,231 @@ def apply_memory_defaults(workspace_id: int, deal: Dict[str, Any], mi: Dict[str,
     return out
 
 def upsert_calibration(workspace_id: int, vacancy_bias: float, oer_bias: float, irr_bias: float):
-    cur = CONN.cursor()
-    cur.execute("""
-        INSERT INTO calibration (workspace_id, created_at, vacancy_bias, oer_bias, irr_bias)
-        VALUES (?, ?, ?, ?, ?)
-        ON CONFLICT(workspace_id) DO UPDATE SET
-            created_at=excluded.created_at,
-            vacancy_bias=excluded.vacancy_bias,
-            oer_bias=excluded.oer_bias,
-            irr_bias=excluded.irr_bias
-    """, (workspace_id, now_utc(), vacancy_bias, oer_bias, irr_bias))
-    CONN.commit()
+    with rw_conn() as conn:
+        conn.execute("""
+            INSERT INTO calibration (workspace_id, created_at, vacancy_bias, oer_bias, irr_bias)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(workspace_id) DO UPDATE SET
+                created_at=excluded.created_at,
+                vacancy_bias=excluded.vacancy_bias,
+                oer_bias=excluded.oer_bias,
+                irr_bias=excluded.irr_bias
+        """, (workspace_id, now_utc(), vacancy_bias, oer_bias, irr_bias))
+        _commit(conn)
+    _calibration_for.clear()
 
 def get_calibration(workspace_id: int) -> Dict[str, float]:
-    cur = CONN.cursor()
-    cur.execute("SELECT vacancy_bias, oer_bias, irr_bias FROM calibration WHERE workspace_id=?", (workspace_id,))
-    row = cur.fetchone()
+    with ro_conn() as conn:
+        row = conn.execute("SELECT vacancy_bias, oer_bias, irr_bias FROM calibration WHERE workspace_id=?", (workspace_id,)).fetchone()
     if not row:
         upsert_calibration(workspace_id, 0.0, 0.0, 0.0)
         return {"vacancy_bias": 0.0, "oer_bias": 0.0, "irr_bias": 0.0}
     return {"vacancy_bias": float(row[0]), "oer_bias": float(row[1]), "irr_bias": float(row[2])}
 
-def save_deal_version(workspace_id: int, deal_id: int, version_num: int, reason: str,
-                      grade_letter: str, grade_score: float, irr_base: float, oer: float, noi: float, payload: Dict[str, Any]):
-    cur = CONN.cursor()
-    cur.execute("""INSERT OR REPLACE INTO deal_versions
-                   (workspace_id, deal_id, version_num, reason, created_at, grade_letter, grade_score, irr_base, oer, noi, payload)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (workspace_id, deal_id, version_num, reason, now_utc(), grade_letter, grade_score, irr_base, oer, noi, json.dumps(payload)))
-    CONN.commit()
-
-def next_version_num(workspace_id: int, deal_id: int) -> int:
-    cur = CONN.cursor()
-    cur.execute("SELECT COALESCE(MAX(version_num), 0) FROM deal_versions WHERE workspace_id=? AND deal_id=?", (workspace_id, deal_id))
-    return int(cur.fetchone()[0]) + 1
+@st.cache_data(ttl=30, max_entries=64, show_spinner=False)
+def _calibration_for(workspace_id: int) -> Dict[str, float]:
+    return get_calibration(workspace_id)
+
+# Version payloads are stored as a JSON Patch against the previous version ({"patch": [...], "base_version": n}),
+# with a full snapshot every _VERSION_SNAPSHOT_EVERY versions so rebuilding one never walks a long chain.
+# Rows written before deltas are all full snapshots.
+_VERSION_SNAPSHOT_EVERY = 10
+
+def get_version_payload(workspace_id: int, deal_id: int, version_num: int,
+                        conn: Optional[sqlite3.Connection]=None) -> Dict[str, Any]:
+    # Pass the writer's connection to see uncommitted versions inside tx().
+    # Replay follows each delta's base_version, not row order: {} if the chain is broken (version_num itself or a
+    # base it needs is missing, or a patch doesn't apply), and save_deal_version then stores a full snapshot.
+    sql = """SELECT version_num, payload FROM deal_versions WHERE workspace_id=? AND deal_id=? AND version_num<=?
+             ORDER BY version_num DESC LIMIT ?"""
+    args = (workspace_id, deal_id, version_num, _VERSION_SNAPSHOT_EVERY)
+    if conn is not None:
+        rows = conn.execute(sql, args).fetchall()
+    else:
+        with ro_conn() as ro:
+            rows = ro.execute(sql, args).fetchall()
+    patches = []
+    want = version_num
+    for num, blob in rows:
+        if num > want:
+            continue
+        if num < want:
+            return {}
+        obj = _unpack(blob)
+        if "patch" not in obj:
+            try:
+                return jsonpatch.apply_patch(obj, [op for p in reversed(patches) for op in p]) if patches else obj
+            except (jsonpatch.JsonPatchException, jsonpatch.JsonPointerException):
+                return {}
+        patches.append(obj["patch"])
+        want = int(obj["base_version"])
+    return {}
+
+def save_deal_version(workspace_id: int, deal_id: int, reason: str,
+                      grade_letter: str, grade_score: float, irr_base: float, oer: float, noi: float, payload: Dict[str, Any],
+                      ts: Optional[str]=None) -> int:
+    # Allocates the next version number itself, inside the BEGIN IMMEDIATE that writes it, so concurrent updates of
+    # one deal get distinct numbers; a plain INSERT makes any collision fail instead of replacing a delta's base.
+    packed = _pack(payload)
+    with tx() as conn:
+        version_num = int(conn.execute("SELECT COALESCE(MAX(version_num), 0) FROM deal_versions WHERE workspace_id=? AND deal_id=?",
+                                       (workspace_id, deal_id)).fetchone()[0]) + 1
+        if (version_num - 1) % _VERSION_SNAPSHOT_EVERY:
+            prev = get_version_payload(workspace_id, deal_id, version_num - 1, conn=conn)
+            if prev:
+                # Diff the JSON form (numpy scalars and tuples normalized); keep the snapshot if the delta isn't smaller.
+                delta = _pack({"patch": jsonpatch.make_patch(prev, _loads(_dumps(payload))).patch, "base_version": version_num - 1})
+                if len(delta) < len(packed):
+                    packed = delta
+        conn.execute("""INSERT INTO deal_versions
+                        (workspace_id, deal_id, version_num, reason, created_at, grade_letter, grade_score, irr_base, oer, noi, payload)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     (workspace_id, deal_id, version_num, reason, ts or now_utc(), grade_letter, grade_score, irr_base, oer, noi, packed))
+    return version_num
 
 def save_deal(workspace_id: int, actor_email: str, source: str, address: str, folder: str, slug: str,
               grade_letter: str, grade_score: float, irr_base: float, oer: float, noi: float, payload: Dict[str, Any]) -> int:
-    cur = CONN.cursor()
-    cur.execute("""INSERT INTO deals (workspace_id, created_at, source, address, folder, slug, grade_letter, grade_score, irr_base, oer, noi, payload)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (workspace_id, now_utc(), source, address, folder, slug, grade_letter, grade_score, irr_base, oer, noi, json.dumps(payload)))
-    CONN.commit()
-    deal_id = int(cur.lastrowid)
-    audit(workspace_id, actor_email, "deal_saved", "deal", deal_id, {"folder": folder, "slug": slug})
-    save_deal_version(workspace_id, deal_id, 1, "initial_save", grade_letter, grade_score, irr_base, oer, noi, payload)
+    ts = now_utc()
+    with tx() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO deals (workspace_id, created_at, source, address, folder, slug, grade_letter, grade_score, irr_base, oer, noi, payload,
+                                          pinned, chat_preview, search_blob, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (workspace_id, ts, source, address, folder, slug, grade_letter, grade_score, irr_base, oer, noi, _pack(payload),
+                     *_deal_digest(payload), ts))
+        deal_id = int(cur.lastrowid)
+        audit(workspace_id, actor_email, "deal_saved", "deal", deal_id, {"folder": folder, "slug": slug}, ts=ts)
+        save_deal_version(workspace_id, deal_id, "initial_save", grade_letter, grade_score, irr_base, oer, noi, payload, ts=ts)
     return deal_id
 
 def update_deal_latest(workspace_id: int, deal_id: int, grade_letter: str, grade_score: float, irr_base: float, oer: float, noi: float, payload: Dict[str, Any]):
-    cur = CONN.cursor()
-    cur.execute("""UPDATE deals SET grade_letter=?, grade_score=?, irr_base=?, oer=?, noi=?, payload=? WHERE workspace_id=? AND id=?""",
-                (grade_letter, grade_score, irr_base, oer, noi, json.dumps(payload), workspace_id, deal_id))
-    CONN.commit()
-
-def list_deals(workspace_id: int, folder: Optional[str]=None):
-    cur = CONN.cursor()
-    if folder:
-        cur.execute("""SELECT id, created_at, folder, address, slug, grade_letter, grade_score, irr_base, oer, noi, payload
-                       FROM deals WHERE workspace_id=? AND folder=? ORDER BY id DESC""", (workspace_id, folder))
-    else:
-        cur.execute("""SELECT id, created_at, folder, address, slug, grade_letter, grade_score, irr_base, oer, noi, payload
-                       FROM deals WHERE workspace_id=? ORDER BY id DESC""", (workspace_id,))
-    return cur.fetchall()
+    # pinned is left alone: once a thread exists, set_deal_pinned owns it.
+    _, preview, blob = _deal_digest(payload)
+    with rw_conn() as conn:
+        conn.execute("""UPDATE deals SET grade_letter=?, grade_score=?, irr_base=?, oer=?, noi=?, payload=?, chat_preview=?, search_blob=?,
+                        updated_at=? WHERE workspace_id=? AND id=?""",
+                     (grade_letter, grade_score, irr_base, oer, noi, _pack(payload), preview, blob, now_utc(), workspace_id, deal_id))
+        _commit(conn)
+
+def set_deal_pinned(workspace_id: int, deal_id: int, pinned: bool):
+    with rw_conn() as conn:
+        conn.execute("UPDATE deals SET pinned=?, updated_at=? WHERE workspace_id=? AND id=?", (int(pinned), now_utc(), workspace_id, deal_id))
+        _commit(conn)
+
+# list_deals orderings: newest first, or the thread list's pinned-then-newest.
+_DEAL_ORDER = {"recent": "id DESC", "pinned_recent": "pinned DESC, id DESC"}
+
+def list_deals(workspace_id: int, folder: Optional[str]=None, with_payload: bool=False, order: str="recent"):
+    # Summary + thread-list digest columns by default; payloads are large and fetched on demand via get_deal_payload.
+    # search_blob stays in the table: search_deal_ids matches against it there.
+    cols = "id, created_at, folder, address, slug, grade_letter, grade_score, irr_base, oer, noi, pinned, chat_preview"
+    if with_payload:
+        cols += ", payload"
+    order_by = _DEAL_ORDER[order]
+    with ro_conn() as conn:
+        if folder:
+            cur = conn.execute(f"SELECT {cols} FROM deals WHERE workspace_id=? AND folder=? ORDER BY {order_by}", (workspace_id, folder))
+        else:
+            cur = conn.execute(f"SELECT {cols} FROM deals WHERE workspace_id=? ORDER BY {order_by}", (workspace_id,))
+        return cur.fetchall()
+
+def search_deal_ids(workspace_id: int, needle: str) -> List[int]:
+    # needle must already be lowercased, like the stored blob (address + every chat message).
+    with ro_conn() as conn:
+        rows = conn.execute("SELECT id FROM deals WHERE workspace_id=? AND instr(search_blob, ?) > 0", (workspace_id, needle)).fetchall()
+    return [int(r[0]) for r in rows]
+
+def deal_watermark(workspace_id: int) -> Tuple[int, int, str]:
+    # (row count, newest id, newest updated_at): changes whenever a deal is added, removed or written.
+    with ro_conn() as conn:
+        n, max_id, max_updated = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(MAX(updated_at), '') FROM deals WHERE workspace_id=?",
+                                              (workspace_id,)).fetchone()
+    return int(n), int(max_id), str(max_updated)
+
+def get_deal_payload(workspace_id: int, deal_id: int) -> Dict[str, Any]:
+    # Shared parse (see _unpack_shared): read-only.
+    with ro_conn() as conn:
+        row = conn.execute("SELECT payload FROM deals WHERE workspace_id=? AND id=?", (workspace_id, deal_id)).fetchone()
+    return _unpack_shared(row[0]) if row else {}
 
 def move_deal(workspace_id: int, actor_email: str, deal_id: int, folder: str):
-    cur = CONN.cursor()
-    cur.execute("UPDATE deals SET folder=? WHERE workspace_id=? AND id=?", (folder, workspace_id, deal_id))
-    CONN.commit()
-    audit(workspace_id, actor_email, "deal_moved", "deal", deal_id, {"new_folder": folder})
+    with tx() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE deals SET folder=?, updated_at=? WHERE workspace_id=? AND id=?", (folder, now_utc(), workspace_id, deal_id))
+        audit(workspace_id, actor_email, "deal_moved", "deal", deal_id, {"new_folder": folder})
 
 def get_deal_row(workspace_id: int, deal_id: int):
-    cur = CONN.cursor()
-    cur.execute("""SELECT id, created_at, folder, address, slug, grade_letter, grade_score, irr_base, oer, noi, payload
-                   FROM deals WHERE workspace_id=? AND id=?""", (workspace_id, deal_id))
-    return cur.fetchone()
+    with ro_conn() as conn:
+        return conn.execute("""SELECT id, created_at, folder, address, slug, grade_letter, grade_score, irr_base, oer, noi, payload
+                               FROM deals WHERE workspace_id=? AND id=?""", (workspace_id, deal_id)).fetchone()
 
 def list_versions(workspace_id: int, deal_id: int) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("""SELECT version_num, reason, created_at, grade_letter, grade_score, irr_base, oer, noi
-                   FROM deal_versions WHERE workspace_id=? AND deal_id=? ORDER BY version_num DESC""",
-                (workspace_id, deal_id))
-    return pd.DataFrame(cur.fetchall(), columns=["version","reason","created_at","grade","score","irr","oer","noi"])
+    with ro_conn() as conn:
+        return pd.read_sql_query("""SELECT version_num AS version, reason, created_at, grade_letter AS grade, grade_score AS score,
+                                          irr_base AS irr, oer, noi
+                                   FROM deal_versions WHERE workspace_id=? AND deal_id=? ORDER BY version_num DESC""",
+                                 conn, params=(workspace_id, deal_id))
 
 def add_note(workspace_id: int, deal_id: int, author_email: str, assignee_email: str, tags: List[str], notes: str):
-    cur = CONN.cursor()
-    cur.execute("""INSERT INTO deal_notes (workspace_id, deal_id, created_at, author_email, assignee_email, tags_json, notes)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (workspace_id, deal_id, now_utc(), safe_email(author_email), safe_email(assignee_email), json.dumps(tags), notes))
-    CONN.commit()
-    audit(workspace_id, author_email, "deal_note_added", "deal", deal_id, {"assignee": safe_email(assignee_email), "tags": tags})
+    with tx() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO deal_notes (workspace_id, deal_id, created_at, author_email, assignee_email, tags_json, notes)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (workspace_id, deal_id, now_utc(), safe_email(author_email), safe_email(assignee_email), _dumps(tags).decode(), notes))
+        audit(workspace_id, author_email, "deal_note_added", "deal", deal_id, {"assignee": safe_email(assignee_email), "tags": tags})
 
 def list_notes(workspace_id: int, deal_id: int) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("""SELECT created_at, author_email, assignee_email, tags_json, notes
-                   FROM deal_notes WHERE workspace_id=? AND deal_id=? ORDER BY id DESC""",
-                (workspace_id, deal_id))
-    rows = cur.fetchall()
-    df = pd.DataFrame(rows, columns=["created_at","author","assignee","tags","notes"])
+    with ro_conn() as conn:
+        df = pd.read_sql_query("""SELECT created_at, author_email AS author, assignee_email AS assignee, tags_json AS tags, notes
+                                 FROM deal_notes WHERE workspace_id=? AND deal_id=? ORDER BY id DESC""",
+                               conn, params=(workspace_id, deal_id))
     if not df.empty:
-        df["tags"] = df["tags"].apply(lambda x: ", ".join(json.loads(x)) if x else "")
+        df["tags"] = df["tags"].map(lambda x: ", ".join(_loads(x)) if x else "")
     return df
 
 def save_memo(workspace_id: int, actor_email: str, slug: str, payload: Dict[str, Any], brand: str, accent: str) -> int:
-    cur = CONN.cursor()
-    cur.execute("""INSERT INTO memos (workspace_id, created_at, slug, brand, accent, payload)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (workspace_id, now_utc(), slug, brand, accent, json.dumps(payload)))
-    CONN.commit()
-    memo_id = int(cur.lastrowid)
-    audit(workspace_id, actor_email, "memo_saved", "memo", memo_id, {"slug": slug})
+    with tx() as conn:
+        cur = conn.cursor()
+        cur.execute("""INSERT INTO memos (workspace_id, created_at, slug, brand, accent, payload)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (workspace_id, now_utc(), slug, brand, accent, _pack(payload)))
+        memo_id = int(cur.lastrowid)
+        audit(workspace_id, actor_email, "memo_saved", "memo", memo_id, {"slug": slug})
     return memo_id
 
 def load_memo_by_slug(workspace_id: int, slug: str):
-    cur = CONN.cursor()
-    cur.execute("""SELECT id, created_at, slug, brand, accent, payload
-                   FROM memos WHERE workspace_id=? AND slug=? ORDER BY id DESC LIMIT 1""", (workspace_id, slug))
-    row = cur.fetchone()
+    with ro_conn() as conn:
+        row = conn.execute("""SELECT id, created_at, slug, brand, accent, payload
+                              FROM memos WHERE workspace_id=? AND slug=? ORDER BY id DESC LIMIT 1""", (workspace_id, slug)).fetchone()
     if not row:
         return None
     mid, created, slug, brand, accent, payload = row
-    obj = json.loads(payload)
+    obj = _unpack(payload)
     obj["_meta"] = {"memo_id": mid, "created_at": created, "slug": slug, "brand": brand, "accent": accent}
     return obj
 
 def list_memos(workspace_id: int, limit: int=200) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("""SELECT id, created_at, slug, brand, accent FROM memos WHERE workspace_id=? ORDER BY id DESC LIMIT ?""",
-                (workspace_id, limit))
-    return pd.DataFrame(cur.fetchall(), columns=["memo_id","created_at","slug","brand","accent"])
-
-def list_audit(workspace_id: int, limit: int=200) -> pd.DataFrame:
-    cur = CONN.cursor()
-    cur.execute("""SELECT created_at, actor_email, action, target_type, target_id, meta
-                   FROM audit_log WHERE workspace_id=? ORDER BY id DESC LIMIT ?""", (workspace_id, limit))
-    df = pd.DataFrame(cur.fetchall(), columns=["created_at","actor","action","target_type","target_id","meta"])
-    if not df.empty:
-        df["meta"] = df["meta"].apply(lambda x: json.loads(x) if x else {})
+    with ro_conn() as conn:
+        return pd.read_sql_query("""SELECT id AS memo_id, created_at, slug, brand, accent FROM memos WHERE workspace_id=? ORDER BY id DESC LIMIT ?""",
+                                 conn, params=(workspace_id, limit))
+
+def list_audit(workspace_id: int, limit: int=200, parse_meta: bool=False) -> pd.DataFrame:
+    # meta stays raw JSON text unless asked for; callers parse only the rows they expand.
+    flush_audit()
+    with ro_conn() as conn:
+        df = pd.read_sql_query("""SELECT created_at, actor_email AS actor, action, target_type, target_id, meta
+                                 FROM audit_log WHERE workspace_id=? ORDER BY id DESC LIMIT ?""",
+                               conn, params=(workspace_id, limit))
+    if parse_meta and not df.empty:
+        df["meta"] = df["meta"].map(lambda x: _loads(x) if x else {})
     return df
 
+def audit_watermark(workspace_id: int) -> int:
+    flush_audit()
+    with ro_conn() as conn:
+        row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM audit_log WHERE workspace_id=?", (workspace_id,)).fetchone()
+    return int(row[0])
+
 # ----------------------------
 # Listing import (demo + RESO scaffold)
 # ----------------------------
@@ -631,16 +1065,59 @@ def demo_listing_from_link(link_or_address: str) -> Dict[str, Any]:
         "state": "AZ",
     }
 
+def demo_listings_from_links(links: List[str]) -> List[Dict[str, Any]]:
+    # Batch form of demo_listing_from_link (identical output): one hashing pass, then array arithmetic over the seeds.
+    if not links:
+        return []
+    digests = b"".join(hashlib.sha256(l.strip().lower().encode("utf-8")).digest()[:4] for l in links)
+    seed = np.frombuffer(digests, dtype=">u4").astype(np.int64)
+    units = 1 + (seed % 64)
+    avg_rent = 1100 + (seed % 2200)
+    price = ((units * avg_rent * 12) / (0.055 + ((seed % 25) / 1000))).astype(np.int64)
+    vacancy = 0.05 + ((seed % 70) / 1000)
+    taxes = (price * (0.010 + ((seed % 30) / 10000))).astype(np.int64)
+    insurance = np.maximum(1800, price * (0.002 + ((seed % 20) / 10000))).astype(np.int64)
+    landlord = (seed % 2) != 0
+    other_income = (seed % 250) * (units > 10)
+    hoa = (seed % 250) * (units <= 8)
+    utilities = (seed % 600) * landlord
+
+    out = []
+    for i, (u, ar, s) in enumerate(zip(units.tolist(), avg_rent.tolist(), seed.tolist())):
+        out.append({
+            "source": "demo",
+            "address": f"{100 + (s % 900)} Market St, Phoenix, AZ",
+            "property_type": "Multifamily" if u >= 10 else "Single Family",
+            "price": int(price[i]),
+            "units": u,
+            "sqft": 900 * u,
+            "avg_rent": ar if u >= 2 else ar * 1.6,
+            "vacancy": round(float(vacancy[i]), 3),
+            "other_income_mo": int(other_income[i]),
+            "taxes": int(taxes[i]),
+            "insurance": int(insurance[i]),
+            "hoa_mo": int(hoa[i]),
+            "utilities_mo": int(utilities[i]),
+            "management_pct": 0.08,
+            "repairs_pct": 0.06,
+            "capex_pct": 0.04,
+            "utilities_party": "Landlord Paid" if landlord[i] else "Tenant Paid",
+            "year_built": 1950 + (s % 70),
+            "city": "Phoenix",
+            "state": "AZ",
+        })
+    return out
+
 def reso_import(link_or_address: str) -> Optional[Dict[str, Any]]:
-    base_url = st.secrets.get("RESO_BASE_URL", "")
-    token = st.secrets.get("RESO_BEARER_TOKEN", "")
+    base_url = _secret("RESO_BASE_URL")
+    token = _secret("RESO_BEARER_TOKEN")
     if not base_url or not token:
         return None
     q = link_or_address.strip()
     headers = {"Authorization": f"Bearer {token}"}
     url = base_url.rstrip("/") + "/Property?$top=1&$filter=contains(UnparsedAddress,'" + q.replace("'", "''") + "')"
     try:
-        r = requests.get(url, headers=headers, timeout=12)
+        r = _HTTP.get(url, headers=headers, timeout=12)
         if r.status_code != 200:
             return None
         data = r.json()
@@ -676,6 +1153,12 @@ def reso_import(link_or_address: str) -> Optional[Dict[str, Any]]:
 def import_listing(link_or_address: str) -> Dict[str, Any]:
     return reso_import(link_or_address) or demo_listing_from_link(link_or_address)
 
+def import_listings(links: List[str]) -> List[Dict[str, Any]]:
+    # Multi-line paste in the sidebar: RESO lookups per link, and the misses go through the batch demo path.
+    found = [reso_import(l) for l in links]
+    demo = iter(demo_listings_from_links([l for l, f in zip(links, found) if not f]))
+    return [f or next(demo) for f in found]
+
 # ----------------------------
 # Metrics + Robust IRR
 # ----------------------------
@@ -710,75 +1193,258 @@ def pmt(rate: float, nper: int, pv: float) -> float:
     if rate == 0: return pv / max(nper, 1)
     return pv * rate / (1 - (1 + rate) ** (-nper))
 
-def _npv_safe(rate: float, cashflows: List[float]) -> float:
+@process_lru_cache(maxsize=64)
+def _periods(n: int) -> np.ndarray:
+    # 0..n-1 as float64, shared by every NPV evaluation of that length (61 for the default 5-year hold).
+    t = np.arange(n, dtype=np.float64)
+    t.flags.writeable = False
+    return t
+
+def _npv_safe(rate: float, cashflows: Union[List[float], np.ndarray]) -> float:
     # rate is periodic; enforce domain
     if rate <= -0.999999:
         return float("inf")
-    lr = math.log1p(rate)
+    cf = np.asarray(cashflows, dtype=np.float64)
+    with np.errstate(over="ignore", under="ignore"):
+        disc = np.power(1.0 + rate, -_periods(cf.size))   # 1/(1+rate)**t; overflow => term ~ inf
+    if disc[-1] > 1e300:
+        # rate < 0, so disc grows with t; same clamp as before: the first unstable term decides the sign
+        i = int(np.argmax(disc > 1e300))
+        return float("inf") if cf[i] > 0 else float("-inf")
+    return float(cf @ disc)
+
+# Same Newton/grid/bracket/bisection contract as _irr_solve, written over float64 arrays so numba can compile it.
+# Discounting is a running multiply instead of exp(t*log1p(r)).
+_IRR_GRID = np.array([-0.95, -0.8, -0.6, -0.4, -0.2, -0.1, -0.05, -0.02, 0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0])
+
+def _npv_kernel(rate, cf, tail):
+    # tail[i] = sum(|cf[i:]|). For positive rates the loop stops once the remaining terms can no longer move
+    # the total across zero or under the 1e-6 convergence threshold, so the result is exact in everything
+    # the IRR kernel looks at (sign, == 0, < 1e-6) but not necessarily the full NPV.
+    # The early exit is numba-only on purpose: _npv_safe discounts the whole vector in one np.power + dot, and
+    # trimming it first (an abs-sum plus a log to find the cutoff) measured slower at 61-361 periods, not faster.
+    if rate <= -0.999999:
+        return np.inf
+    growth = 1.0 + rate
+    disc = 1.0
     total = 0.0
-    for t, cf in enumerate(cashflows):
-        exp_arg = t * lr
-        if exp_arg > 700:   # exp(>709) overflows in float64; term ~ 0
-            disc = float("inf")
-        elif exp_arg < -700:
-            disc = 0.0
-        else:
-            disc = math.exp(exp_arg)
-        if disc == 0.0:
-            # huge negative exp_arg => discount ~ 0 => term ~ inf, but that's unstable; clamp
-            return float("inf") if cf > 0 else float("-inf")
-        if disc == float("inf"):
-            # huge positive exp_arg => denominator infinite => term ~ 0
-            continue
-        total += cf / disc
+    for i in range(cf.size):
+        if disc > 1e300:    # later terms ~ 0
+            break
+        if disc < 1e-300:   # term ~ inf; same clamp as _npv_safe
+            return np.inf if cf[i] > 0 else -np.inf
+        total += cf[i] / disc
+        disc *= growth
+        if rate > 0 and i + 1 < cf.size and abs(total) > tail[i + 1] / disc + 1e-6:
+            break
     return total
 
-def irr_robust(cashflows: List[float]) -> float:
-    # Returns periodic IRR. Avoids Newton blowups by bracketing + bisection.
-    # Search a grid for sign changes.
+_npv_nb = process_njit(_npv_kernel)
+
+def _sign_changes(cf):
+    # Sign changes between consecutive nonzero cashflows (_is_conventional: exactly one).
+    n = 0
+    prev = 0.0
+    for c in cf:
+        if c != 0.0:
+            if prev != 0.0 and (c > 0.0) != (prev > 0.0):
+                n += 1
+            prev = c
+    return n
+
+_sign_changes_nb = process_njit(_sign_changes)
+
+def _newton_kernel(cf):
+    # _irr_newton over a running discount: nan wherever that returns None.
+    rate = 0.01
+    for _ in range(30):
+        growth = 1.0 + rate
+        disc = 1.0
+        f = 0.0
+        df = 0.0
+        for i in range(cf.size):
+            term = cf[i] / disc
+            f += term
+            df -= i * term
+            disc *= growth
+        df /= growth
+        if not (np.isfinite(f) and np.isfinite(df)) or df == 0.0:
+            return np.nan
+        step = f / df
+        rate -= step
+        if not -0.95 <= rate <= 5.0:
+            return np.nan
+        if abs(f) < 1e-6 or abs(step) < 1e-12:
+            return rate
+    return np.nan
+
+_newton_nb = process_njit(_newton_kernel)
+
+def _bracket_widen_kernel(cf, full):
+    # _irr_bracket_widen as (a, b, fa, fb): a == b for an exact root, all nan when it gives up. full is an
+    # all-inf tail, which turns off _npv_kernel's early exit: choosing the side to widen compares |NPV|s.
     lo, hi = -0.95, 5.0
-    grid = [-0.95, -0.8, -0.6, -0.4, -0.2, -0.1, -0.05, -0.02, 0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0]
-    vals = []
-    for r in grid:
-        try:
-            vals.append(_npv_safe(r, cashflows))
-        except Exception:
-            vals.append(float("nan"))
-
-    # Find first bracket where NPV changes sign
-    bracket = None
-    for i in range(len(grid)-1):
-        a, b = grid[i], grid[i+1]
-        fa, fb = vals[i], vals[i+1]
-        if not (math.isfinite(fa) and math.isfinite(fb)):
-            continue
+    a, b = -0.05, 0.4
+    fa, fb = _npv_nb(a, cf, full), _npv_nb(b, cf, full)
+    for i in range(11):
+        if not (np.isfinite(fa) and np.isfinite(fb)):
+            break
         if fa == 0.0:
-            return a
+            return a, a, fa, fa
         if fb == 0.0:
-            return b
-        if (fa > 0 and fb < 0) or (fa < 0 and fb > 0):
-            bracket = (a, b, fa, fb)
+            return b, b, fb, fb
+        if (fa > 0) != (fb > 0):
+            return a, b, fa, fb
+        if i == 10 or (a <= lo and b >= hi):
             break
+        if (abs(fa) < abs(fb) and a > lo) or b >= hi:
+            a = max(lo, a - (b - a))
+            fa = _npv_nb(a, cf, full)
+        else:
+            b = min(hi, b + (b - a))
+            fb = _npv_nb(b, cf, full)
+    return np.nan, np.nan, np.nan, np.nan
+
+_bracket_widen_nb = process_njit(_bracket_widen_kernel)
+
+def _irr_kernel(cf):
+    # Returns nan when every method fails; irr_robust handles that case.
+    conventional = _sign_changes_nb(cf) == 1
+    if conventional:
+        r = _newton_nb(cf)
+        if np.isfinite(r):
+            return r
+    tail = np.cumsum(np.abs(cf)[::-1])[::-1]
+    a = b = fa = fb = np.nan
+    if conventional:
+        a, b, fa, fb = _bracket_widen_nb(cf, np.full(cf.size, np.inf))
+    if np.isnan(a):
+        n = _IRR_GRID.size
+        vals = np.empty(n)
+        for i in range(n):
+            vals[i] = _npv_nb(_IRR_GRID[i], cf, tail)
+        for i in range(n - 1):
+            ga, gb, gfa, gfb = _IRR_GRID[i], _IRR_GRID[i + 1], vals[i], vals[i + 1]
+            if not (np.isfinite(gfa) and np.isfinite(gfb)):
+                continue
+            if gfa == 0.0:
+                return ga
+            if gfb == 0.0:
+                return gb
+            if (gfa > 0 and gfb < 0) or (gfa < 0 and gfb > 0):
+                a, b, fa, fb = ga, gb, gfa, gfb
+                break
+        if np.isnan(a):
+            return np.nan
+    elif a == b:
+        return a
+    for _ in range(80):
+        mid = (a + b) / 2
+        fm = _npv_nb(mid, cf, tail)
+        if not np.isfinite(fm):
+            mid = (mid + a) / 2
+            fm = _npv_nb(mid, cf, tail)
+        if abs(fm) < 1e-6:
+            return mid
+        if (fa > 0 and fm < 0) or (fa < 0 and fm > 0):
+            b, fb = mid, fm
+        else:
+            a, fa = mid, fm
+    return (a + b) / 2
 
+_irr_nb = process_njit(_irr_kernel)
+
+def _irr_batch_kernel(cf_mat):
+    # One _irr_kernel per row; rows are independent, so numba spreads them across cores.
+    out = np.empty(cf_mat.shape[0])
+    for i in prange(cf_mat.shape[0]):
+        out[i] = _irr_nb(cf_mat[i])
+    return out
+
+_irr_batch_nb = process_njit(_irr_batch_kernel, parallel=True)
+
+@st.cache_resource(show_spinner=False)
+def _warm_irr_kernel() -> None:
+    # Compile (or load from numba's on-disk cache) up front so the first underwrite doesn't pay for it.
+    if njit is not None:
+        cf = np.full(61, 400.0); cf[0] = -100000.0; cf[-1] += 110000.0
+        _irr_nb(cf)
+        _irr_batch_nb(np.stack([cf, cf]))
+
+_warm_irr_kernel()
+
+def _npv_and_deriv(rate: float, cf: np.ndarray, tcf: np.ndarray) -> Tuple[float, float]:
+    # NPV and dNPV/drate from one discount vector: d/dr [c / (1+r)**t] = -t * c / (1+r)**(t+1). tcf = t * cf.
+    with np.errstate(over="ignore", under="ignore"):
+        disc = np.power(1.0 + rate, -_periods(cf.size))
+    return float(cf @ disc), -float(tcf @ disc) / (1.0 + rate)
+
+def _is_conventional(cf: np.ndarray) -> bool:
+    # One sign change => a single IRR above -100%, so any method that finds a root finds that one.
+    nz = cf[cf != 0]
+    return np.count_nonzero(np.diff(nz > 0)) == 1
+
+def _irr_newton(cf: np.ndarray) -> Optional[float]:
+    # Only for conventional cashflows, so Newton lands on the same root the grid/bisection would bracket.
+    # Returns None when that doesn't hold or Newton doesn't settle.
+    if not _is_conventional(cf):
+        return None
+    tcf = _periods(cf.size) * cf
+    rate = 0.01   # periodic (monthly) rate
+    for _ in range(30):
+        f, df = _npv_and_deriv(rate, cf, tcf)
+        if not (math.isfinite(f) and math.isfinite(df)) or df == 0.0:
+            return None
+        step = f / df
+        rate -= step
+        # Leaving the grid's search range means Newton is diverging (or the root is one the grid wouldn't
+        # bracket either); hand over to the grid straight away rather than clamping and retrying.
+        if not -0.95 <= rate <= 5.0:
+            return None
+        if abs(f) < 1e-6 or abs(step) < 1e-12:
+            return rate
+    return None
+
+def irr_robust(cashflows: List[float]) -> float:
+    # Returns periodic IRR: Newton on conventional cashflows, else bracketing + bisection (no Newton blowups).
+    # The compiled kernel and _irr_solve run the same methods in the same order; numba only changes the speed.
+    cf = np.asarray(cashflows, dtype=np.float64)   # converted once; every NPV below is a dot product
+    r = _irr_nb(cf) if njit is not None else _irr_solve(cf)
+    if math.isfinite(r):
+        return float(r)
+    # fallback: try numpy if available; else return 0
+    try:
+        r = np.irr(cf)  # type: ignore
+        if r is not None and not np.isnan(r):
+            return float(r)
+    except Exception:
+        pass
+    return 0.0
+
+def _irr_solve(cf: np.ndarray) -> float:
+    # NumPy path of irr_robust; nan when no method finds a root.
+    r = _irr_newton(cf)
+    if r is not None:
+        return r
+    # Conventional cashflows have one root, so widening a bracket around the usual range takes a few NPVs
+    # instead of the full grid scan; the grid's "first sign change" only matters when there are several roots.
+    bracket = _irr_bracket_widen(cf) if _is_conventional(cf) else None
     if bracket is None:
-        # fallback: try numpy if available; else return 0
-        try:
-            r = np.irr(np.array(cashflows, dtype=float))  # type: ignore
-            if r is not None and not np.isnan(r):
-                return float(r)
-        except Exception:
-            pass
-        return 0.0
+        bracket = _irr_grid_bracket(cf)
+    if isinstance(bracket, float):
+        return bracket
+    if bracket is None:
+        return float("nan")
 
     a, b, fa, fb = bracket
     # bisection
     for _ in range(80):
         mid = (a + b) / 2
-        fm = _npv_safe(mid, cashflows)
+        fm = _npv_safe(mid, cf)
         if not math.isfinite(fm):
             # nudge slightly toward finite region
             mid = (mid + a) / 2
-            fm = _npv_safe(mid, cashflows)
+            fm = _npv_safe(mid, cf)
         if abs(fm) < 1e-6:
             return mid
         if (fa > 0 and fm < 0) or (fa < 0 and fm > 0):
@@ -787,11 +1453,192 @@ def irr_robust(cashflows: List[float]) -> float:
             a, fa = mid, fm
     return (a + b) / 2
 
+def _irr_bracket_widen(cf: np.ndarray) -> Union[Tuple[float, float, float, float], float, None]:
+    # Start from [-5%, 40%] and double outward on the side with the smaller |NPV| (up to 10 times), staying
+    # inside the grid's [-0.95, 5.0] range. Same returns as _irr_grid_bracket.
+    lo, hi = -0.95, 5.0
+    a, b = -0.05, 0.4
+    fa, fb = _npv_safe(a, cf), _npv_safe(b, cf)
+    for i in range(11):
+        if not (math.isfinite(fa) and math.isfinite(fb)):
+            return None
+        if fa == 0.0:
+            return a
+        if fb == 0.0:
+            return b
+        if (fa > 0) != (fb > 0):
+            return (a, b, fa, fb)
+        if i == 10 or (a <= lo and b >= hi):
+            return None
+        if (abs(fa) < abs(fb) and a > lo) or b >= hi:
+            a = max(lo, a - (b - a)); fa = _npv_safe(a, cf)
+        else:
+            b = min(hi, b + (b - a)); fb = _npv_safe(b, cf)
+    return None
+
+def _irr_grid_bracket(cf: np.ndarray) -> Union[Tuple[float, float, float, float], float, None]:
+    # First grid interval where the NPV changes sign; a float when a grid point is an exact root.
+    grid = [-0.95, -0.8, -0.6, -0.4, -0.2, -0.1, -0.05, -0.02, 0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0]
+    vals = []
+    for r in grid:
+        try:
+            vals.append(_npv_safe(r, cf))
+        except Exception:
+            vals.append(float("nan"))
+
+    for i in range(len(grid)-1):
+        a, b = grid[i], grid[i+1]
+        fa, fb = vals[i], vals[i+1]
+        if not (math.isfinite(fa) and math.isfinite(fb)):
+            continue
+        if fa == 0.0:
+            return a
+        if fb == 0.0:
+            return b
+        if (fa > 0 and fb < 0) or (fa < 0 and fb > 0):
+            return (a, b, fa, fb)
+    return None
+
+def _npv_rows(rates: np.ndarray, cf_mat: np.ndarray, tcf_mat: Optional[np.ndarray]=None):
+    # NPV of row i at rates[i], with _npv_safe's domain and overflow clamps applied per row.
+    # With tcf_mat (= t * cf_mat) also returns dNPV/drate per row.
+    with np.errstate(over="ignore", under="ignore", invalid="ignore"):
+        disc = np.power(1.0 + rates[:, None], -_periods(cf_mat.shape[1]))
+        npv = np.einsum("ij,ij->i", cf_mat, disc)
+        dnpv = None if tcf_mat is None else -np.einsum("ij,ij->i", tcf_mat, disc) / (1.0 + rates)
+    blown = disc[:, -1] > 1e300
+    if blown.any():
+        rows = np.flatnonzero(blown)
+        first = cf_mat[rows, np.argmax(disc[rows] > 1e300, axis=1)]
+        npv[rows] = np.where(first > 0, np.inf, -np.inf)
+    npv[rates <= -0.999999] = np.inf
+    return npv if tcf_mat is None else (npv, dnpv)
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _grid_discounts(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    # 1/(1+g)**t for every _IRR_GRID rate g, plus the first period at which each rate's discount blows up (-1: never).
+    with np.errstate(over="ignore"):
+        disc = np.power(1.0 + _IRR_GRID[:, None], -_periods(n))
+    blown = disc > 1e300
+    first = np.where(blown.any(axis=1), np.argmax(blown, axis=1), -1)
+    disc[blown] = 0.0
+    disc.flags.writeable = False
+    return disc, first
+
+def irr_matrix(cf_mat: np.ndarray) -> np.ndarray:
+    # Periodic IRR of every row of a (scenarios, periods) matrix, solved together: the grid scan and each
+    # refinement step are one vectorized NPV evaluation across all rows. Rows get irr_robust's grid bracket, then
+    # Newton steps kept inside the bracket (bisecting whenever Newton would leave it), so they converge in a
+    # handful of steps and can never escape to another root. Rows without a bracket end like irr_robust's.
+    cf_mat = np.asarray(cf_mat, dtype=np.float64)
+    k = cf_mat.shape[0]
+    # whole grid scan as one matmul; blown-up rates get _npv_safe's clamp (sign of the first unstable cashflow)
+    disc, first = _grid_discounts(cf_mat.shape[1])
+    vals = cf_mat @ disc.T
+    for j in np.flatnonzero(first >= 0):
+        vals[:, j] = np.where(cf_mat[:, first[j]] > 0, np.inf, -np.inf)
+    fa_all, fb_all = vals[:, :-1], vals[:, 1:]
+    usable = np.isfinite(fa_all) & np.isfinite(fb_all)
+    hit = usable & ((fa_all == 0.0) | (fb_all == 0.0) | ((fa_all > 0) & (fb_all < 0)) | ((fa_all < 0) & (fb_all > 0)))
+    has = hit.any(axis=1)
+    i = np.argmax(hit, axis=1)
+    rows = np.arange(k)
+    a, b = _IRR_GRID[i], _IRR_GRID[i + 1]
+    fa, fb = fa_all[rows, i], fb_all[rows, i]
+
+    out = np.full(k, np.nan)
+    exact_a = has & (fa == 0.0)
+    exact_b = has & ~exact_a & (fb == 0.0)
+    out[exact_a] = a[exact_a]
+    out[exact_b] = b[exact_b]
+    active = has & ~exact_a & ~exact_b
+
+    tcf_mat = _periods(cf_mat.shape[1]) * cf_mat
+    x = (a + b) / 2
+    for _ in range(80):
+        if not active.any():
+            break
+        f, df = _npv_rows(x, cf_mat, tcf_mat)
+        bad = ~np.isfinite(f)
+        if bad.any():
+            # nudge slightly toward finite region
+            x = np.where(bad, (x + a) / 2, x)
+            f2, df2 = _npv_rows(x, cf_mat, tcf_mat)
+            f, df = np.where(bad, f2, f), np.where(bad, df2, df)
+        done = active & (np.abs(f) < 1e-6)
+        out[done] = x[done]
+        active &= ~done
+        left = ((fa > 0) & (f < 0)) | ((fa < 0) & (f > 0))
+        b = np.where(left, x, b)
+        a = np.where(left, a, x)
+        fa = np.where(left, fa, f)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            newton = x - f / df
+        x = np.where(np.isfinite(newton) & (newton > a) & (newton < b), newton, (a + b) / 2)
+    out[active] = x[active]
+    for r in np.flatnonzero(~has):
+        # irr_robust would miss the same grid bracket, leaving only its Newton attempt (numpy>=1.20 has no np.irr)
+        root = _irr_newton(cf_mat[r])
+        out[r] = root if root is not None else np.nan
+    return out
+
+def irr_batch(cf_mat: np.ndarray) -> np.ndarray:
+    # Periodic IRR of every row. With numba the rows go through the compiled kernel in parallel (row for row what
+    # irr_robust returns); without it, irr_matrix solves them together in NumPy. Rows no method solves are nan
+    # rather than irr_robust's 0.0, so callers can tell "no IRR" from a 0% IRR.
+    cf_mat = np.ascontiguousarray(cf_mat, dtype=np.float64)
+    if njit is None:
+        return irr_matrix(cf_mat)
+    return _irr_batch_nb(cf_mat)
+
+def _loan_balance_after(loan0: float, r_m: float, pay: float, months: int, nper: int) -> float:
+    # Closed-form amortization residual; the loan is fully paid after nper payments and stays at zero.
+    k = min(months, nper)
+    if r_m == 0:
+        return max(0.0, loan0 - pay * k)
+    f = (1.0 + r_m) ** k
+    return max(0.0, loan0 * f - pay * (f - 1.0) / r_m)
+
 def build_cashflows(deal: Dict[str, Any], m: Dict[str, Any], hold_years: int, rent_growth: float, expense_growth: float,
                     exit_cap: float, sale_cost_pct: float,
                     down_payment_pct: float, interest_rate: float, amort_years: int) -> Dict[str, Any]:
+    out = _cashflow_model(_deal_price(deal, m), float(m["egi"]), float(m["opex"]), hold_years, rent_growth, expense_growth,
+                          exit_cap, sale_cost_pct, down_payment_pct, interest_rate, amort_years)
+    # The cached result is shared; hand out a copy callers can mutate or store.
+    return dict(out, cashflows=list(out["cashflows"]))
+
+def _deal_price(deal: Dict[str, Any], m: Dict[str, Any]) -> float:
+    return float(deal.get("price") or 0) or (m["noi"] / max(0.05, m["cap_rate"] or 0.06))
+
+@st.cache_resource(show_spinner=False, max_entries=1024)
+def _cashflow_model(price: float, egi: float, opex: float, hold_years: int, rent_growth: float, expense_growth: float,
+                    exit_cap: float, sale_cost_pct: float,
+                    down_payment_pct: float, interest_rate: float, amort_years: int) -> Dict[str, Any]:
+    # Everything build_cashflows needs from the deal, as hashable scalars. Reruns, the sensitivity probe and
+    # re-grading with another scoring profile all hit the same few keys.
+    cf, sale_price, net_sale, loan_balance = _cashflow_schedule(price, egi, opex, hold_years, rent_growth, expense_growth,
+                                                                exit_cap, sale_cost_pct, down_payment_pct, interest_rate, amort_years)
+    cashflows = cf.tolist()
+
+    irr_m = irr_robust(cf)
+    irr_a = (1 + irr_m) ** 12 - 1 if irr_m > -0.999 else -1.0
+    eq_mult = float(np.maximum(cf[1:], 0.0).sum()) / abs(float(cf[0])) if cf[0] != 0 else 0.0
+    return {"cashflows": cashflows, "irr_monthly": irr_m, "irr_annual": irr_a, "equity_multiple": eq_mult,
+            "sale_price": sale_price, "net_sale": net_sale, "end_loan_balance": loan_balance}
+
+@process_lru_cache(maxsize=256)
+def _growth_vec(rate: float, months: int) -> np.ndarray:
+    # (1+rate)**((k-1)//12) for months k=1..months. Rent and expense growth rarely change between the
+    # sensitivity scenarios, so callers round the rate to keep float noise from splitting the cache.
+    g = np.power(1.0 + rate, np.arange(months) // 12)
+    g.flags.writeable = False
+    return g
+
+def _cashflow_schedule(price: float, egi: float, opex: float, hold_years: int, rent_growth: float, expense_growth: float,
+                       exit_cap: float, sale_cost_pct: float,
+                       down_payment_pct: float, interest_rate: float, amort_years: int) -> Tuple[np.ndarray, float, float, float]:
+    # Monthly levered cashflows (sale proceeds folded into the last month), sale price, net sale, ending loan balance.
     months = hold_years * 12
-    price = float(deal.get("price") or 0) or (m["noi"] / max(0.05, m["cap_rate"] or 0.06))
     equity0 = -price * down_payment_pct
     loan0 = price * (1 - down_payment_pct)
 
@@ -799,32 +1646,76 @@ def build_cashflows(deal: Dict[str, Any], m: Dict[str, Any], hold_years: int, re
     nper = amort_years * 12
     pay = pmt(r_m, nper, loan0)
 
-    cashflows = [equity0]
-    loan_balance = loan0
+    egi_m0 = egi / 12.0
+    opex_m0 = opex / 12.0
 
-    egi_m0 = m["egi"] / 12.0
-    opex_m0 = m["opex"] / 12.0
-
-    for month in range(1, months + 1):
-        y = (month - 1) // 12
-        egi_m = egi_m0 * ((1 + rent_growth) ** y)
-        opex_m = opex_m0 * ((1 + expense_growth) ** y)
-        noi_m = egi_m - opex_m
-        interest = loan_balance * r_m
-        principal = max(0.0, pay - interest)
-        loan_balance = max(0.0, loan_balance - principal)
-        cashflows.append(noi_m - pay)
+    # Month k (1-based) grows by (1+g)**((k-1)//12); the whole schedule is built at once.
+    cf = np.empty(months + 1)
+    cf[0] = equity0
+    cf[1:] = (egi_m0 * _growth_vec(round(rent_growth, 8), months)
+              - opex_m0 * _growth_vec(round(expense_growth, 8), months) - pay)
+    loan_balance = _loan_balance_after(loan0, r_m, pay, months, nper)
 
     last_noi_annual = (egi_m0 * ((1+rent_growth) ** (hold_years-1)) - opex_m0 * ((1+expense_growth) ** (hold_years-1))) * 12.0
     sale_price = last_noi_annual / max(0.01, exit_cap)
     sale_cost = sale_price * sale_cost_pct
     net_sale = sale_price - sale_cost - loan_balance
-    cashflows[-1] += net_sale
-
-    irr_m = irr_robust(cashflows)
-    irr_a = (1 + irr_m) ** 12 - 1 if irr_m > -0.999 else -1.0
-    eq_mult = (sum(cf for cf in cashflows[1:] if cf > 0) / abs(cashflows[0])) if cashflows[0] != 0 else 0
-    return {"cashflows": cashflows, "irr_monthly": irr_m, "irr_annual": irr_a, "equity_multiple": eq_mult,
+    cf[-1] += net_sale
+    return cf, sale_price, net_sale, loan_balance
+
+# Model inputs in _cashflow_schedule's positional order, with the defaults used when a key is missing.
+_MODEL_INPUTS = (("hold_years", 5), ("rent_growth", 0.03), ("expense_growth", 0.025), ("exit_cap", 0.065),
+                 ("sale_cost_pct", 0.05), ("down_payment_pct", 0.25), ("interest_rate", 0.065), ("amort_years", 30))
+_MODEL_INPUT_INDEX = {k: i for i, (k, _) in enumerate(_MODEL_INPUTS)}
+
+def _model_args(mi: Dict[str, Any]) -> Tuple[float, ...]:
+    return tuple(float(mi.get(k, d)) for k, d in _MODEL_INPUTS)
+
+def _with_arg(args: Tuple[float, ...], key: str, value: float) -> Tuple[float, ...]:
+    i = _MODEL_INPUT_INDEX[key]
+    return args[:i] + (value,) + args[i+1:]
+
+def build_cashflows_batch(deal: Dict[str, Any], m: Dict[str, Any],
+                          scenarios: List[Union[Dict[str, Any], Tuple[float, ...]]]) -> Dict[str, np.ndarray]:
+    """Cashflow schedules for several model-input scenarios on one deal, one row per scenario.
+
+    Scenarios are model-input dicts or _model_args tuples. Same math as _cashflow_schedule, broadcast across
+    scenarios. Rows shorter than the longest hold are zero-padded past their sale month, which leaves their
+    IRR unchanged.
+    """
+    cols = np.array([s if isinstance(s, tuple) else _model_args(s) for s in scenarios], dtype=np.float64).T
+    hold, rg, eg, exit_cap, sale_cost_pct, dp, rate, amort = cols
+    hold = hold.astype(np.int64)
+    nper = amort.astype(np.int64) * 12
+
+    price, egi_m0, opex_m0 = _deal_price(deal, m), float(m["egi"]) / 12.0, float(m["opex"]) / 12.0
+    months = hold * 12
+    loan0 = price * (1 - dp)
+    r_m = rate / 12.0
+    k = np.minimum(months, nper)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pay = np.where(r_m == 0, loan0 / np.maximum(nper, 1), loan0 * r_m / (1 - (1 + r_m) ** (-nper.astype(np.float64))))
+        f = (1 + r_m) ** k
+        loan_balance = np.maximum(0.0, np.where(r_m == 0, loan0 - pay * k, loan0 * f - pay * (f - 1) / r_m))
+
+    y = np.arange(months.max()) // 12
+    cf = np.zeros((len(scenarios), months.max() + 1))
+    cf[:, 0] = -price * dp
+    cf[:, 1:] = (egi_m0 * np.power(1 + np.round(rg, 8)[:, None], y)
+                 - opex_m0 * np.power(1 + np.round(eg, 8)[:, None], y) - pay[:, None])
+    cf[:, 1:][y[None, :] >= hold[:, None]] = 0.0
+
+    last_noi_annual = (egi_m0 * (1 + rg) ** (hold - 1) - opex_m0 * (1 + eg) ** (hold - 1)) * 12.0
+    sale_price = last_noi_annual / np.maximum(0.01, exit_cap)
+    net_sale = sale_price - sale_price * sale_cost_pct - loan_balance
+    rows = np.arange(len(scenarios))
+    cf[rows, months] += net_sale
+
+    irr_m = irr_batch(cf)
+    irr_a = np.where(np.isnan(irr_m) | (irr_m > -0.999), (1 + irr_m) ** 12 - 1, -1.0)   # nan stays nan
+    eq0 = np.abs(cf[:, 0])
+    eq_mult = np.divide(np.maximum(cf[:, 1:], 0.0).sum(axis=1), eq0, out=np.zeros(len(scenarios)), where=eq0 != 0)
+    return {"cashflows": cf, "months": months, "irr_monthly": irr_m, "irr_annual": irr_a, "equity_multiple": eq_mult,
             "sale_price": sale_price, "net_sale": net_sale, "end_loan_balance": loan_balance}
 
 def aire_grade(m: Dict[str, Any], irr_a: float, calib: Dict[str, float], scoring_profile: str) -> Dict[str, Any]:
@@ -859,10 +1750,77 @@ def aire_grade(m: Dict[str, Any], irr_a: float, calib: Dict[str, float], scoring
     letter = "A" if score >= 90 else "B" if score >= 80 else "C" if score >= 70 else "D" if score >= 60 else "F"
     return {"score": score, "letter": letter, "confidence": 0.78, "flags": flags, "irr_adj": irr_adj, "profile": scoring_profile}
 
-def apply_chat_update(user_text: str, deal: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+_DEFAULT_MODEL_INPUTS = {
+    "hold_years": 5, "rent_growth": 0.03, "expense_growth": 0.025,
+    "exit_cap": 0.065, "sale_cost_pct": 0.05,
+    "down_payment_pct": 0.25, "interest_rate": 0.065, "amort_years": 30
+}
+
+def _model_bundle(deal: Dict[str, Any], mi: Dict[str, Any], calib: Dict[str, float],
+                  scoring_profile: str) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    # metrics -> cashflow model -> grade for one set of model inputs. The cashflow model underneath is already
+    # memoized (_cashflow_model), and the rest is a few dozen float ops: cheaper than hashing the deal for a cache.
+    m = compute_metrics(deal, calib)
+    model = build_cashflows(deal, m, int(mi["hold_years"]), float(mi["rent_growth"]), float(mi["expense_growth"]),
+                            float(mi["exit_cap"]), float(mi["sale_cost_pct"]),
+                            float(mi["down_payment_pct"]), float(mi["interest_rate"]), int(mi["amort_years"]))
+    return m, model, aire_grade(m, float(model["irr_annual"]), calib, scoring_profile)
+
+# One scan over the message; when several fields are mentioned the earlier group wins,
+# matching the order the individual patterns used to be tried in.
+_RX_CHAT_UPDATE = re.compile(
+    r"vacancy\s*(?:to|at|=)\s*(?P<vacancy>[0-9]+(?:\.[0-9]+)?)\s*%?"
+    r"|tax(?:es)?\s*(?:to|at|=)\s*\$?\s*(?P<taxes>[0-9][0-9,]*)"
+    r"|rent\s*(?:to|at|=)\s*\$?\s*(?P<rent>[0-9][0-9,]*)"
+    r"|price\s*(?:to|at|=)\s*\$?\s*(?P<price>[0-9][0-9,]*)"
+)
+_CHAT_UPDATE_ORDER = ("vacancy", "taxes", "rent", "price")
+
+def _sensitivity_grid_reply(grid: List[Dict[str, float]]) -> str:
+    if not grid:
+        return "Couldn't run the sensitivity grid on the current inputs."
+    rgs = " / ".join(f"{c['rent_growth']:.1%}" for c in grid[:3])
+    lines = [f"Sensitivity grid — levered IRR at rent growth {rgs}:"]
+    for i in range(0, len(grid), 3):
+        row = grid[i:i+3]
+        irrs = " / ".join("n/a" if math.isnan(c["irr_annual"]) else f"{c['irr_annual']:.1%}" for c in row)
+        lines.append(f"Exit cap {row[0]['exit_cap']:.2%} · Rate {row[0]['interest_rate']:.2%}: {irrs}")
+    return "\n".join(lines)
+
+def apply_chat_update(user_text: str, deal: Dict[str, Any], metrics: Optional[Dict[str, Any]] = None,
+                      mi: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
     t = user_text.lower()
+    if "sensitivity grid" in t and metrics is not None:
+        return deal, _sensitivity_grid_reply(sensitivity_grid(deal, mi or {}, metrics))
 
+    found: Dict[str, str] = {}
+    for m in _RX_CHAT_UPDATE.finditer(t):
+        found.setdefault(m.lastgroup, m.group(m.lastgroup))
+        if m.lastgroup == "vacancy":   # nothing outranks it
+            break
 
+    for field in _CHAT_UPDATE_ORDER:
+        if field in found:
+            raw = found[field]
+            break
+    else:
+        return deal, "Try: “vacancy to 10%”, “taxes to 22000”, “rent to 1750”, “price to 525000”."
+
+    # Copy on write: callers get their own deal back untouched when nothing applies.
+    deal = dict(deal)
+    if field == "vacancy":
+        v = float(raw)
+        v = v/100.0 if v > 1 else v
+        deal["vacancy"] = max(0.0, min(0.25, v)); return deal, f"Updated vacancy to {deal['vacancy']:.1%}."
+    val = float(raw.replace(",", ""))
+    if field == "taxes":
+        deal["taxes"] = int(val); return deal, f"Updated annual taxes to ${deal['taxes']:,}."
+    if field == "rent":
+        deal["avg_rent"] = float(val); return deal, f"Updated average rent to ${deal['avg_rent']:,.0f}/month."
+    deal["price"] = int(val); return deal, f"Updated price to ${deal['price']:,}."
+
+
+@st.cache_data(show_spinner=False, max_entries=256)
 def suggest_actions(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[str, Any], grade: Dict[str, Any]) -> List[Dict[str, str]]:
     actions: List[Dict[str, str]] = []
     flags = grade.get("flags", []) if isinstance(grade, dict) else []
@@ -889,43 +1847,29 @@ def suggest_actions(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[str,
     actions.append({"label": "Sensitivity grid", "command": "sensitivity grid"})
     actions.append({"label": "Stress test", "command": "stress test"})
 
-    # de-dupe
-    seen = set()
-    out = []
-    for a in actions:
-        if a["label"] in seen:
-            continue
-        seen.add(a["label"])
-        out.append(a)
-    return out[:8]
+    # de-dupe by label, keeping first-seen order (repeated labels always carry the same command)
+    return list({a["label"]: a for a in actions}.values())[:8]
 
 
+@st.cache_data(show_spinner=False, max_entries=256)
 def quick_sensitivity(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[str, Any]) -> Dict[str, float]:
     """Fast, lightweight sensitivity probe to rank action chips."""
     try:
-        base = build_cashflows(deal, metrics, int(mi.get("hold_years", 5)), float(mi.get("rent_growth", 0.03)), float(mi.get("expense_growth", 0.025)),
-                               float(mi.get("exit_cap", 0.065)), float(mi.get("sale_cost_pct", 0.05)),
-                               float(mi.get("down_payment_pct", 0.25)), float(mi.get("interest_rate", 0.065)), int(mi.get("amort_years", 30)))
-        base_irr = float(base.get("irr_annual", 0.0))
+        # base + small stresses, solved as one batch
+        base = _model_args(mi)
+        _, rg, _, ec, _, _, ir, _ = base
+        scenarios = [
+            base,
+            _with_arg(base, "exit_cap", ec + 0.005),
+            _with_arg(base, "interest_rate", ir + 0.005),
+            _with_arg(base, "rent_growth", max(0.0, rg - 0.01)),
+        ]
+        # unsolved rows count as 0%, as in the single-scenario model
+        irr_a = np.nan_to_num(build_cashflows_batch(deal, metrics, scenarios)["irr_annual"], nan=0.0)
     except Exception:
         return {}
 
-    def _irr_with(**kw):
-        mi2 = dict(mi or {})
-        mi2.update(kw)
-        try:
-            mod = build_cashflows(deal, metrics, int(mi2.get("hold_years", 5)), float(mi2.get("rent_growth", 0.03)), float(mi2.get("expense_growth", 0.025)),
-                                  float(mi2.get("exit_cap", 0.065)), float(mi2.get("sale_cost_pct", 0.05)),
-                                  float(mi2.get("down_payment_pct", 0.25)), float(mi2.get("interest_rate", 0.065)), int(mi2.get("amort_years", 30)))
-            return float(mod.get("irr_annual", 0.0))
-        except Exception:
-            return base_irr
-
-    # small stresses
-    irr_exit = _irr_with(exit_cap=float(mi.get("exit_cap", 0.065)) + 0.005)
-    irr_rate = _irr_with(interest_rate=float(mi.get("interest_rate", 0.065)) + 0.005)
-    irr_rent = _irr_with(rent_growth=max(0.0, float(mi.get("rent_growth", 0.03)) - 0.01))
-
+    base_irr, irr_exit, irr_rate, irr_rent = (float(x) for x in irr_a)
     return {
         "base": base_irr,
         "exit_cap_+50bps": base_irr - irr_exit,
@@ -933,35 +1877,62 @@ def quick_sensitivity(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[st
         "rent_growth_-1pt": base_irr - irr_rent,
     }
 
+@st.cache_data(show_spinner=False, max_entries=256)
+def sensitivity_grid(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[str, Any]) -> List[Dict[str, float]]:
+    """Annual IRR over exit cap × interest rate × rent growth (±50bps, ±50bps, ±1pt), solved as one batch.
+
+    Cells whose cashflows have no IRR the solver can find are nan.
+    """
+    try:
+        base = _model_args(mi)
+        _, rg, _, ec, _, _, ir, _ = base
+        cells = [{"exit_cap": max(0.01, ec + d_ec), "interest_rate": max(0.0, ir + d_ir), "rent_growth": max(0.0, rg + d_rg)}
+                 for d_ec in (-0.005, 0.0, 0.005) for d_ir in (-0.005, 0.0, 0.005) for d_rg in (-0.01, 0.0, 0.01)]
+        scenarios = []
+        for cell in cells:
+            args = base
+            for k, v in cell.items():
+                args = _with_arg(args, k, v)
+            scenarios.append(args)
+        irr_a = build_cashflows_batch(deal, metrics, scenarios)["irr_annual"]
+    except Exception:
+        return []
+    return [dict(cell, irr_annual=float(v)) for cell, v in zip(cells, irr_a)]
+
+@st.cache_data(show_spinner=False, max_entries=256)
 def suggest_action_chips(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict[str, Any], grade: Dict[str, Any]) -> List[Dict[str, str]]:
     """Top action chips shown under the assistant's last message."""
     actions = suggest_actions(deal, mi, metrics, grade)
     sens = quick_sensitivity(deal, mi, metrics)
     flags = grade.get("flags", []) if isinstance(grade, dict) else []
 
+    # Flag categories, counted once up front so scoring an action is a few lookups
+    flag_cats: Dict[str, int] = {"expense": 0, "vacancy": 0, "rent": 0, "cap": 0}
+    for f in flags:
+        lf = str(f).lower()
+        if "expense" in lf or "oer" in lf: flag_cats["expense"] += 1
+        if "vacancy" in lf: flag_cats["vacancy"] += 1
+        if "rent" in lf: flag_cats["rent"] += 1
+        if "cap" in lf: flag_cats["cap"] += 1
+    volatile = max(sens.get("exit_cap_+50bps",0), sens.get("rate_+50bps",0), sens.get("rent_growth_-1pt",0)) > 0.02
+
     # Rank actions: sensitivity first, then flags, then defaults
     def score(a):
         cmd = a.get("command","").lower()
         sc = 0.0
         if "exit cap" in cmd:
-            sc += 5.0 * float(sens.get("exit_cap_+50bps", 0.0))
+            sc += 5.0 * float(sens.get("exit_cap_+50bps", 0.0)) + 0.30 * flag_cats["cap"]
         if "rate" in cmd:
             sc += 5.0 * float(sens.get("rate_+50bps", 0.0))
         if "rent" in cmd:
-            sc += 3.0 * float(sens.get("rent_growth_-1pt", 0.0))
-        for f in flags:
-            lf = str(f).lower()
-            if ("expense" in lf or "oer" in lf) and ("expense" in cmd or "oer" in cmd):
-                sc += 0.35
-            if "vacancy" in lf and "vacancy" in cmd:
-                sc += 0.35
-            if "rent" in lf and "rent" in cmd:
-                sc += 0.30
-            if "cap" in lf and "exit cap" in cmd:
-                sc += 0.30
+            sc += 3.0 * float(sens.get("rent_growth_-1pt", 0.0)) + 0.30 * flag_cats["rent"]
+        if "expense" in cmd or "oer" in cmd:
+            sc += 0.35 * flag_cats["expense"]
+        if "vacancy" in cmd:
+            sc += 0.35 * flag_cats["vacancy"]
         # Encourage at least one "grid" button when things are volatile
         if "sensitivity" in cmd:
-            sc += 0.15 + (0.8 if max(sens.get("exit_cap_+50bps",0), sens.get("rate_+50bps",0), sens.get("rent_growth_-1pt",0)) > 0.02 else 0)
+            sc += 0.15 + (0.8 if volatile else 0)
         return sc
 
     actions_sorted = sorted(actions, key=score, reverse=True)
@@ -976,39 +1947,16 @@ def suggest_action_chips(deal: Dict[str, Any], mi: Dict[str, Any], metrics: Dict
     return chips
 
 
-    def find_pct(pats):
-        for p in pats:
-            m = re.search(p, t)
-            if m:
-                v = float(m.group(1))
-                return v/100.0 if v > 1 else v
-        return None
-
-    def find_money(pats):
-        for p in pats:
-            m = re.search(p, t)
-            if m:
-                return float(m.group(1).replace(",",""))
-        return None
-
-    v = find_pct([r"vacancy\s*(?:to|at|=)\s*([0-9]+(?:\.[0-9]+)?)\s*%?"])
-    if v is not None:
-        deal["vacancy"] = max(0.0, min(0.25, v)); return deal, f"Updated vacancy to {deal['vacancy']:.1%}."
-    tx = find_money([r"tax(?:es)?\s*(?:to|at|=)\s*\$?\s*([0-9][0-9,]*)"])
-    if tx is not None:
-        deal["taxes"] = int(tx); return deal, f"Updated annual taxes to ${deal['taxes']:,}."
-    rent = find_money([r"rent\s*(?:to|at|=)\s*\$?\s*([0-9][0-9,]*)"])
-    if rent is not None:
-        deal["avg_rent"] = float(rent); return deal, f"Updated average rent to ${deal['avg_rent']:,.0f}/month."
-    price = find_money([r"price\s*(?:to|at|=)\s*\$?\s*([0-9][0-9,]*)"])
-    if price is not None:
-        deal["price"] = int(price); return deal, f"Updated price to ${deal['price']:,}."
-    return deal, "Try: “vacancy to 10%”, “taxes to 22000”, “rent to 1750”, “price to 525000”."
-
 # ----------------------------
 # Memo PDF
 # ----------------------------
-def generate_memo_pdf_bytes(brand: str, accent: str, logo_b64: str, memo: Dict[str, Any]) -> bytes:
+# persist="disk" keeps rendered memos across restarts; entries are keyed on the content of every argument. The
+# "Generated" stamp is not one of them: the body is rendered once with _PDF_STAMP_SLOT in its place, and
+# generate_memo_pdf_bytes swaps in the real stamp (same length, so the xref offsets stay valid) on every download.
+_PDF_STAMP_SLOT = "0000-00-00 00:00 UTC"
+
+@st.cache_data(show_spinner=False, max_entries=256, persist="disk")
+def _memo_pdf_template(brand: str, accent: str, logo_b64: str, memo: Dict[str, Any]) -> bytes:
     from reportlab.lib.pagesizes import LETTER
     from reportlab.pdfgen import canvas
     from reportlab.lib.utils import ImageReader
@@ -1016,7 +1964,7 @@ def generate_memo_pdf_bytes(brand: str, accent: str, logo_b64: str, memo: Dict[s
 
     deal = memo["deal"]; m = memo["metrics"]; g = memo["grade"]; mod = memo["model"]; inputs = memo["model_inputs"]
     buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=LETTER)
+    c = canvas.Canvas(buf, pagesize=LETTER, pageCompression=0)   # uncompressed, so the stamp slot is findable
     w, h = LETTER
     ar, ag, ab = hex_to_rgb01(accent)
     c.setFillColorRGB(ar, ag, ab); c.rect(0, h-44, w, 44, stroke=0, fill=1)
@@ -1034,7 +1982,7 @@ def generate_memo_pdf_bytes(brand: str, accent: str, logo_b64: str, memo: Dict[s
     y = h - 70
     c.setFont("Helvetica", 9)
     c.drawString(44, y, f"Property: {deal.get('address','')}")
-    c.drawString(44, y-12, f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')} | Source: {deal.get('source','demo').upper()} | Profile: {g.get('profile','Core')}")
+    c.drawString(44, y-12, f"Generated: {_PDF_STAMP_SLOT} | Source: {deal.get('source','demo').upper()} | Profile: {g.get('profile','Core')}")
     y -= 26
 
     c.setFont("Helvetica-Bold", 10); c.drawString(44, y, "AIRE Vector Grade™")
@@ -1045,27 +1993,48 @@ def generate_memo_pdf_bytes(brand: str, accent: str, logo_b64: str, memo: Dict[s
     c.drawString(44, y, f"EGI ${m['egi']:,.0f} · OpEx ${m['opex']:,.0f} (OER {m['oer']:.1%}) · NOI ${m['noi']:,.0f} · Cap {m.get('cap_rate',0):.2%}")
     y -= 16
 
+    # Section bodies go out as one text object each (a single BT/ET block and font setting) instead of
+    # a drawString per line.
+    def text_block(lines: List[str], y: float) -> float:
+        t = c.beginText(60, y)
+        t.setFont("Helvetica", 9, leading=12)
+        for line in lines:
+            t.textLine(line)
+        c.drawText(t)
+        return y - 12 * len(lines)
+
     c.setFont("Helvetica-Bold", 10); c.drawString(44, y, "Expense Breakdown (Annual)"); y -= 14
-    c.setFont("Helvetica", 9)
-    for label, val in [("Taxes", m["taxes"]),("Insurance", m["insurance"]),("HOA", m["hoa"]),("Utilities", m["utilities"]),
-                       ("Management", m["mgmt"]),("Repairs", m["repairs"]),("CapEx Reserve", m["capex"]),("Total OpEx", m["opex"])]:
-        c.drawString(60, y, f"{label}:"); c.drawRightString(250, y, f"${val:,.0f}"); y -= 12
+    rows = [("Taxes", m["taxes"]),("Insurance", m["insurance"]),("HOA", m["hoa"]),("Utilities", m["utilities"]),
+            ("Management", m["mgmt"]),("Repairs", m["repairs"]),("CapEx Reserve", m["capex"]),("Total OpEx", m["opex"])]
+    y_rows = y
+    y = text_block([f"{label}:" for label, _ in rows], y)
+    # amounts stay right-aligned at x=250: position each one, but keep them in a single text object
+    t = c.beginText()
+    t.setFont("Helvetica", 9)
+    for i, (_, val) in enumerate(rows):
+        s = f"${val:,.0f}"
+        t.setTextOrigin(250 - c.stringWidth(s, "Helvetica", 9), y_rows - 12 * i)
+        t.textOut(s)
+    c.drawText(t)
 
     y -= 4
     c.setFont("Helvetica-Bold", 10); c.drawString(44, y, "Terms & Exit"); y -= 14
-    c.setFont("Helvetica", 9)
-    c.drawString(60, y, f"Hold {inputs['hold_years']}y · Rent {inputs['rent_growth']:.1%} · Exp {inputs['expense_growth']:.1%}"); y -= 12
-    c.drawString(60, y, f"Exit cap {inputs['exit_cap']:.2%} · Sale costs {inputs['sale_cost_pct']:.1%} · Sale ${mod.get('sale_price',0):,.0f}"); y -= 16
+    y = text_block([f"Hold {inputs['hold_years']}y · Rent {inputs['rent_growth']:.1%} · Exp {inputs['expense_growth']:.1%}",
+                    f"Exit cap {inputs['exit_cap']:.2%} · Sale costs {inputs['sale_cost_pct']:.1%} · Sale ${mod.get('sale_price',0):,.0f}"], y)
+    y -= 4
 
     c.setFont("Helvetica-Bold", 10); c.drawString(44, y, "AI Notes"); y -= 14
-    c.setFont("Helvetica", 9)
-    for n in (g.get("flags", [])[:6] or ["No major flags based on provided inputs."]):
-        c.drawString(60, y, f"• {n}"); y -= 12
+    y = text_block([f"• {n}" for n in (g.get("flags", [])[:6] or ["No major flags based on provided inputs."])], y)
 
     c.showPage(); c.save()
     buf.seek(0)
     return buf.read()
 
+def generate_memo_pdf_bytes(brand: str, accent: str, logo_b64: str, memo: Dict[str, Any], generated: str) -> bytes:
+    stamp = generated.ljust(len(_PDF_STAMP_SLOT))[:len(_PDF_STAMP_SLOT)]
+    return _memo_pdf_template(brand, accent, logo_b64, memo).replace(
+        b"Generated: " + _PDF_STAMP_SLOT.encode("ascii"), b"Generated: " + stamp.encode("ascii"), 1)
+
 # ----------------------------
 # Workspace + "login" (POC)
 # ----------------------------
@@ -1079,7 +2048,7 @@ with st.sidebar:
     email = st.text_input("Email", value=st.session_state.get("email",""))
     st.session_state.email = email
 
-settings = get_settings(workspace_id)
+settings = _settings_for(workspace_id)
 folders = settings["folders"]
 scoring_profile = settings["scoring_profile"]
 webhook_url = settings["webhook_url"]
@@ -1089,15 +2058,14 @@ invite_code = qp.get("invite")
 if invite_code and st.session_state.get("email"):
     ok, msg = accept_invite(workspace_id, st.session_state["email"], str(invite_code))
     if ok:
-        audit(workspace_id, st.session_state["email"], "invite_accepted", "workspace", workspace_id, {"code": str(invite_code)})
+        audit(workspace_id, st.session_state["email"], "invite_accepted", "workspace", workspace_id, {"code": str(invite_code)}, sync=True)
         st.success(msg)
     else:
         st.warning(msg)
 
 if email:
-    cur = CONN.cursor()
-    cur.execute("SELECT COUNT(*) FROM users WHERE workspace_id=?", (workspace_id,))
-    cnt = int(cur.fetchone()[0])
+    with ro_conn() as conn:
+        cnt = int(conn.execute("SELECT COUNT(*) FROM users WHERE workspace_id=?", (workspace_id,)).fetchone()[0])
     role_default = "admin" if cnt == 0 else "analyst"
     ensure_user(email, workspace_id, role_default)
     st.session_state.role = get_user_role(email, workspace_id)
@@ -1126,125 +2094,187 @@ def maybe_render_shareable_memo(workspace_id: int):
 def _get_memo_from_deal_row(row) -> Optional[Dict[str, Any]]:
     if not row:
         return None
-    payload = json.loads(row[-1])
-    return payload.get("memo")
+    memo = _unpack_shared(row[-1]).get("memo")
+    if memo is None:
+        return None
+    # The parse is shared; copy the parts this page changes in place (top-level keys, model input sliders, chat).
+    return dict(memo, model_inputs=dict(memo.get("model_inputs") or {}), chat=list(memo.get("chat") or []))
+
+# First keyword found in a flag picks its follow-up; checked in this order.
+_FOLLOWUPS = {
+    "expense": "Break down expenses: what line items drive OER and what can be reduced?",
+    "vacancy": "What is the market vacancy and how does it change cashflow?",
+    "cap rate": "What comps justify the exit cap rate and current cap rate?",
+    "irr": "What assumptions must be true to get IRR above 12%?",
+}
+# All keywords in one pass over the flag; precedence is then _FOLLOWUPS order, not position in the text.
+_RX_FOLLOWUP = re.compile("|".join(map(re.escape, _FOLLOWUPS)))
+_FOLLOWUP_FIRST = next(iter(_FOLLOWUPS))
+
+def _followup_for(lf: str) -> Optional[str]:
+    found = set()
+    for m in _RX_FOLLOWUP.finditer(lf):
+        found.add(m.group(0))
+        if m.group(0) == _FOLLOWUP_FIRST:   # nothing outranks it
+            break
+    return next((q for key, q in _FOLLOWUPS.items() if key in found), None)
 
 def _suggest_followups(flags: List[str]) -> List[str]:
     qs = []
     for f in (flags or [])[:4]:
-        lf = f.lower()
-        if "expense" in lf:
-            qs.append("Break down expenses: what line items drive OER and what can be reduced?")
-        elif "vacancy" in lf:
-            qs.append("What is the market vacancy and how does it change cashflow?")
-        elif "cap rate" in lf:
-            qs.append("What comps justify the exit cap rate and current cap rate?")
-        elif "irr" in lf:
-            qs.append("What assumptions must be true to get IRR above 12%?")
-        else:
-            qs.append(f"What evidence do we need to validate: {f}")
+        lf = f if f.islower() else f.lower()
+        qs.append(_followup_for(lf) or f"What evidence do we need to validate: {f}")
     if not qs:
         qs = ["What’s the biggest risk on this deal?", "What assumption is most sensitive?", "What would make this deal a 'No'?"]
-    out = []
-    for q in qs:
-        if q not in out:
-            out.append(q)
-    return out[:4]
+    return list(dict.fromkeys(qs))[:4]
+
+# KPI row above the chat: one line of markup, so the element carries no indentation/newlines.
+_KPI_TMPL = ('<div class="kpiRow">'
+             '<div class="kpi"><div class="label">Grade</div><div class="value">{grade} <span class="small">({score:.0f})</span></div></div>'
+             '<div class="kpi"><div class="label">IRR</div><div class="value">{irr:.1%}</div></div>'
+             '<div class="kpi"><div class="label">Expense Ratio</div><div class="value">{oer:.1%}</div></div>'
+             '<div class="kpi"><div class="label">NOI</div><div class="value">${noi:,.0f}</div></div>'
+             '</div>')
 
 def _render_bubbles(chat_msgs: List[Dict[str,str]]):
-    st.markdown('<div class="chatWrap">', unsafe_allow_html=True)
+    # One markdown element for the whole thread (and the chatWrap div now actually wraps the bubbles).
+    parts = ['<div class="chatWrap">']
     for msg in chat_msgs:
         role = msg.get("role","assistant")
         cls = "user" if role == "user" else "assistant"
         content = (msg.get("content","") or "").replace("\n","<br/>")
-        st.markdown(f'''
-        <div class="bubble {cls}">
-          <div class="role">{role.upper()}</div>
-          <div>{content}</div>
-        </div>
-        ''', unsafe_allow_html=True)
-    st.markdown('</div>', unsafe_allow_html=True)
+        parts.append(f'<div class="bubble {cls}"><div class="role">{role.upper()}</div><div>{content}</div></div>')
+    parts.append('</div>')
+    st.markdown("".join(parts), unsafe_allow_html=True)
 
 # --- Sidebar: Threads (Pipeline) ---
 if not st.session_state.get("email"):
     st.info("Enter your email in the sidebar to enable threads + saved deals.")
     st.stop()
 
-rows_all = list_deals(workspace_id, None)
-threads = []
-for (deal_id, created, folder_, address, slug, gl, gs, irr, oer, noi, payload) in rows_all:
-    memo = json.loads(payload).get("memo", {})
-    threads.append({
+def _rel_time(iso: str) -> str:
+    try:
+        secs = (datetime.utcnow() - datetime.fromisoformat(iso)).total_seconds()
+    except ValueError:
+        return ""
+    if secs < 60:
+        return "just now"
+    if secs < 3600:
+        return f"{int(secs // 60)}m ago"
+    if secs < 86400:
+        return f"{int(secs // 3600)}h ago"
+    if secs < 7 * 86400:
+        return f"{int(secs // 86400)}d ago"
+    return iso[:10]
+
+def _search_head(address: str, folder: str, grade: str) -> str:
+    # The short fields search also matches; chat text is matched in SQL (search_deal_ids).
+    head = f"{address or ''} {folder or ''} {grade or ''}"
+    return head if head.islower() else head.lower()
+
+def _trunc(s: str, n: int=42) -> str:
+    return s if len(s) <= n else s[:n].rstrip() + "…"
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def _threads_for(workspace_id: int, watermark: Tuple[int, int, str]) -> List[Dict[str, Any]]:
+    # watermark only keys the cache: any write to the workspace's deals moves it (see deal_watermark).
+    # ChatGPT-like ordering, done by SQLite: pinned first, then most recent.
+    # Only what the sidebar reads: this list is unpickled on every rerun. Exports read list_deals themselves.
+    return [{
         "deal_id": int(deal_id),
         "created_at": created,
         "folder": folder_,
-        "address": address,
-        "slug": slug,
-        "grade": gl,
-        "score": gs,
-        "irr": irr,
-        "oer": oer,
-        "noi": noi,
-        "memo": memo
-    })
-
-with st.sidebar:
-    st.markdown("### Threads")
-    st.caption("Pipeline works like chat history. Click a deal to open its thread.")
-
-    st.markdown("#### New deal")
-    link = st.text_input("Paste listing link/address", key="thread_import_link", placeholder="Paste link or address…")
-    if st.button("Import", use_container_width=True):
-        if link.strip():
-            st.session_state.deal = import_listing(link.strip())
-            st.session_state.draft_model_inputs = apply_memory_defaults(workspace_id, st.session_state.deal, st.session_state.get("draft_model_inputs") or {})
-            st.session_state.active_deal_id = None
-            st.session_state.chat = [{"role":"assistant","content":"Imported. Ask follow-ups or adjust assumptions (e.g., “vacancy to 10% and taxes to 22000”)."}]
-            audit(workspace_id, st.session_state["email"], "listing_imported", "listing", None, {"input": link.strip()})
-            st.rerun()
-        else:
-            st.warning("Paste a link or address.")
-
-    st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
-    folder_filter = st.selectbox("Folder", ["All"] + folders, index=0)
-    q = st.text_input("Search", value="", placeholder="Search address or messages…")
+        "pinned": bool(pinned_),
+        "chat_preview": preview_,
+        "title": _trunc(f'{gl} • {address or "Deal"}'),
+        "_head": _search_head(address, folder_, gl)
+    } for (deal_id, created, folder_, address, _, gl, _, _, _, _, pinned_, preview_) in list_deals(workspace_id, None, order="pinned_recent")]
+
+# The full chat text stays out of the cached thread list (it would be unpickled on every rerun); a query is
+# matched in SQLite once per (watermark, query).
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def _search_hits(workspace_id: int, watermark: Tuple[int, int, str], qq: str) -> set:
+    return set(search_deal_ids(workspace_id, qq))
+
+deal_mark = deal_watermark(workspace_id)
+
+# Each thread tile is ~6 sidebar elements; render a page at a time rather than all 160 on every rerun.
+_THREAD_PAGE = 40
+
+_PIPELINE_COLS = ["deal_id", "created_at", "folder", "address", "slug", "grade", "score", "irr", "oer", "noi"]
+
+def _pipeline_frame(workspace_id: int) -> pd.DataFrame:
+    # Straight from the list_deals row tuples into columns; no per-deal dicts.
+    df = pd.DataFrame.from_records([r[:10] for r in list_deals(workspace_id)], columns=_PIPELINE_COLS).drop(columns="created_at")
+    df = df.astype({"deal_id": "int64", "score": "float64", "irr": "float64", "oer": "float64", "noi": "float64"})
+    df["score"] = df["score"].round(1)
+    return df.sort_values(["folder","irr","score"], ascending=[True, False, False])
+
+# Export bytes are built when a download button is clicked and cached on the same watermark as the thread list
+# (plus the audit log's, for the bundle), so repeat downloads of an unchanged workspace are free.
+@st.cache_data(max_entries=16, show_spinner=False)
+def _pipeline_csv(workspace_id: int, watermark: Tuple[int, int, str]) -> bytes:
+    return _pipeline_frame(workspace_id).to_csv(index=False).encode("utf-8")
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _pipeline_parquet(workspace_id: int, watermark: Tuple[int, int, str]) -> bytes:
+    import io
+    buf = io.BytesIO()
+    _pipeline_frame(workspace_id).to_parquet(buf, index=False)
+    return buf.getvalue()
 
-    filtered = threads
+@st.cache_data(max_entries=16, show_spinner=False)
+def _pipeline_xlsx(workspace_id: int, watermark: Tuple[int, int, str], audit_mark: int,
+                   calib: Dict[str, float], settings: Dict[str, Any]) -> bytes:
+    import io
+    xbuf = io.BytesIO()
+    with pd.ExcelWriter(xbuf, engine=XLSX_ENGINE) as writer:
+        _pipeline_frame(workspace_id).to_excel(writer, sheet_name="Pipeline", index=False)
+        list_audit(workspace_id, limit=500).to_excel(writer, sheet_name="AuditLog", index=False)
+        pd.DataFrame([calib]).to_excel(writer, sheet_name="Calibration", index=False)
+        pd.DataFrame([settings]).to_excel(writer, sheet_name="Settings", index=False)
+    return xbuf.getvalue()
+
+def _set_thread_limit(n: int):
+    st.session_state.thread_limit = n
+
+# A fragment: the folder filter, search, pin toggles and "Show more" rerun only the thread list (callbacks do the
+# writes first). Open still reruns the whole app, since the main view changes.
+@st.fragment
+def _thread_list(workspace_id: int, folders: List[str]):
+    # A new filter or search starts again from the first page.
+    folder_filter = st.selectbox("Folder", ["All"] + folders, index=0, on_change=_set_thread_limit, args=(_THREAD_PAGE,))
+    q = st.text_input("Search", value="", placeholder="Search address or messages…",
+                      on_change=_set_thread_limit, args=(_THREAD_PAGE,))
+
+    deal_mark = deal_watermark(workspace_id)
+    filtered = _threads_for(workspace_id, deal_mark)
     if folder_filter != "All":
         filtered = [t for t in filtered if t["folder"] == folder_filter]
     if q.strip():
-        qq = q.strip().lower()
-        filtered = [t for t in filtered if qq in _search_blob(t)]
+        qq = q.strip()
+        qq = qq if qq.islower() else qq.lower()
+        hits = _search_hits(workspace_id, deal_mark, qq)
+        filtered = [t for t in filtered if qq in t["_head"] or t["deal_id"] in hits]
 
     if not filtered:
         st.caption("No saved deals yet. Import a new deal above.")
     else:
-        # ChatGPT-like ordering: pinned first, then most recent
-        filtered = sorted(filtered, key=lambda x: (0 if _is_pinned(x["memo"]) else 1, -int(x["deal_id"])))[:160]
-        st.markdown('<div class="threadList">', unsafe_allow_html=True)
+        filtered = filtered[:160]
+        shown = int(st.session_state.get("thread_limit", _THREAD_PAGE))
 
-        for t in filtered:
-            memo = t["memo"] or {}
-            pinned = _is_pinned(memo)
+        for t in filtered[:shown]:
+            pinned = t["pinned"]
             ts = _rel_time(str(t.get("created_at","")))
-            title = f'{t["grade"]} • {t["address"] or "Deal"}'
-            if len(title) > 42:
-                title = title[:42].rstrip() + "…"
-            preview = _chat_preview(memo)
+            title = t["title"]
+            preview = html.escape(t["chat_preview"])
 
             # Two controls: pin toggle + open
             c_pin, c_open = st.columns([1, 6], gap="small")
             with c_pin:
                 icon = "★" if pinned else "☆"
-                if st.button(icon, key=f"pin_{t['deal_id']}", help="Pin/unpin", use_container_width=True):
-                    new_memo = _set_pinned_in_memo(memo, not pinned)
-                    update_deal_latest(
-                        workspace_id, int(t["deal_id"]),
-                        t["grade"], float(t["score"]), float(t["irr"]),
-                        float(t["oer"]), float(t["noi"]),
-                        {"memo": new_memo}
-                    )
-                    st.rerun()
+                st.button(icon, key=f"pin_{t['deal_id']}", help="Pin/unpin", use_container_width=True,
+                          on_click=set_deal_pinned, args=(workspace_id, int(t["deal_id"]), not pinned))
 
             with c_open:
                 st.markdown(f'''
@@ -1260,62 +2290,104 @@ with st.sidebar:
                 if st.button("Open", key=f"open_{t['deal_id']}", use_container_width=True):
                     st.session_state.active_deal_id = int(t["deal_id"])
                     st.session_state.deal = None
-                    st.session_state.chat = (memo.get("chat") or [{"role":"assistant","content":"Thread loaded. Ask changes like “rent to 1750” or “vacancy to 9%”."}])
-                    st.rerun()
+                    st.session_state.chat = list(get_deal_payload(workspace_id, int(t["deal_id"])).get("memo", {}).get("chat") or [{"role":"assistant","content":"Thread loaded. Ask changes like “rent to 1750” or “vacancy to 9%”."}])
+                    st.rerun()   # the whole app: the main view switches to this thread
+
+        if len(filtered) > shown:
+            st.button(f"Show more ({len(filtered) - shown})", key="thread_more", use_container_width=True,
+                      on_click=_set_thread_limit, args=(shown + _THREAD_PAGE,))
+
+with st.sidebar:
+    st.markdown("### Threads")
+    st.caption("Pipeline works like chat history. Click a deal to open its thread.")
 
-        st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown("#### New deal")
+    link = st.text_area("Paste listing link/address", key="thread_import_link", height=68,
+                        placeholder="Paste link or address… (one per line to save several as threads)")
+    links = [l.strip() for l in link.splitlines() if l.strip()]
+    if st.button("Import", use_container_width=True):
+        if len(links) > 1:
+            # Batch: each listing is graded with the default inputs (plus workspace memory) and saved as a thread.
+            calib = _calibration_for(workspace_id)
+            folder = "Maybe" if "Maybe" in folders else folders[0]
+            saved = []
+            with tx():
+                for d in import_listings(links):
+                    mi = {**_DEFAULT_MODEL_INPUTS, **apply_memory_defaults(workspace_id, d, {})}
+                    m, model, g = _model_bundle(d, mi, calib, scoring_profile)
+                    memo = {"deal": d, "metrics": m, "grade": g, "model": model, "model_inputs": mi,
+                            "workspace": {"name": ws_name, "profile": scoring_profile},
+                            "chat": [{"role":"assistant","content":"Imported in a batch. Ask follow-ups or adjust assumptions, then update the thread."}]}
+                    slug = slugify(f"{d.get('city','')}-{m.get('units',1)}u-{g.get('letter','A')}-{d.get('address','')}")
+                    did = save_deal(workspace_id, st.session_state["email"], d.get("source","demo"), d.get("address",""), folder, slug,
+                                    g["letter"], float(g["score"]), float(model["irr_annual"]), float(m["oer"]), float(m["noi"]), {"memo": memo})
+                    saved.append({"event": "deal_saved", "workspace_id": workspace_id, "deal_id": did, "folder": folder,
+                                  "slug": slug, "address": d.get("address", ""), "grade": g["letter"],
+                                  "score": float(g["score"]), "irr_annual": float(model["irr_annual"])})
+                audit(workspace_id, st.session_state["email"], "listing_imported", "listing", None, {"inputs": links, "folder": folder})
+            for event in saved:   # after the commit, like the single save
+                post_webhook_async(webhook_url, event)
+            st.rerun()
+        elif links:
+            st.session_state.deal = import_listing(links[0])
+            st.session_state.draft_model_inputs = apply_memory_defaults(workspace_id, st.session_state.deal, st.session_state.get("draft_model_inputs") or {})
+            st.session_state.active_deal_id = None
+            st.session_state.chat = [{"role":"assistant","content":"Imported. Ask follow-ups or adjust assumptions (e.g., “vacancy to 10% and taxes to 22000”)."}]
+            audit(workspace_id, st.session_state["email"], "listing_imported", "listing", None, {"input": links[0]})
+            st.rerun()
+        else:
+            st.warning("Paste a link or address.")
 
+    st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
+    _thread_list(workspace_id, folders)
 
     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
     with st.expander("Workspace tools", expanded=False):
         st.caption("Exports + governance are what companies pay for.")
-        if threads:
-            import io
-            df = pd.DataFrame([{
-                "deal_id": t["deal_id"], "folder": t["folder"], "address": t["address"], "slug": t["slug"],
-                "grade": t["grade"], "score": round(float(t["score"]),1),
-                "irr": float(t["irr"]), "oer": float(t["oer"]), "noi": float(t["noi"])
-            } for t in threads]).sort_values(["folder","irr","score"], ascending=[True, False, False])
-            st.download_button("Export CSV", data=df.to_csv(index=False).encode("utf-8"), file_name=f"{BRAND}_pipeline.csv", use_container_width=True)
-
-            xbuf = io.BytesIO()
-            with pd.ExcelWriter(xbuf, engine="openpyxl") as writer:
-                df.to_excel(writer, sheet_name="Pipeline", index=False)
-                list_audit(workspace_id, limit=500).to_excel(writer, sheet_name="AuditLog", index=False)
-                pd.DataFrame([get_calibration(workspace_id)]).to_excel(writer, sheet_name="Calibration", index=False)
-                pd.DataFrame([get_settings(workspace_id)]).to_excel(writer, sheet_name="Settings", index=False)
-            xbuf.seek(0)
-            st.download_button("Export Excel Bundle", data=xbuf.read(), file_name=f"{BRAND}_workspace_bundle.xlsx", use_container_width=True)
+        if deal_mark[0]:
+            # data callables run on click; watermarks are read then, so the bytes always match the workspace.
+            st.download_button("Export CSV", data=lambda: _pipeline_csv(workspace_id, deal_watermark(workspace_id)),
+                               file_name=f"{BRAND}_pipeline.csv", mime="text/csv", use_container_width=True)
+            if HAS_PARQUET:
+                st.download_button("Export Parquet", data=lambda: _pipeline_parquet(workspace_id, deal_watermark(workspace_id)),
+                                   file_name=f"{BRAND}_pipeline.parquet", mime="application/vnd.apache.parquet",
+                                   use_container_width=True)
+            st.download_button("Export Excel Bundle",
+                               data=lambda: _pipeline_xlsx(workspace_id, deal_watermark(workspace_id), audit_watermark(workspace_id),
+                                                           _calibration_for(workspace_id), _settings_for(workspace_id)),
+                               file_name=f"{BRAND}_workspace_bundle.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
         else:
             st.caption("Save at least one deal to export.")
 
     role = st.session_state.get("role","analyst")
-    with st.expander("Admin", expanded=False):
-        st.caption("Roles + invites + webhooks (corporate-ready).")
-        if role != "admin":
-            st.info("You are an Analyst. Admin controls are locked in this POC.")
-        users_df = list_users(workspace_id)
-        st.dataframe(users_df, use_container_width=True, height=180)
-
-        if role == "admin":
-            st.markdown("#### Invitations")
-            inv_email = st.text_input("Invite email", value="", key="inv_email_thread")
-            inv_role = st.selectbox("Role", ["analyst","admin"], index=0, key="inv_role_thread")
-            if st.button("Generate invite", use_container_width=True, key="gen_inv_thread"):
-                if inv_email.strip():
-                    code = upsert_invite(workspace_id, inv_email.strip(), inv_role)
-                    st.success("Invite created.")
-                    st.code(f"?invite={code}", language="text")
-                else:
-                    st.warning("Enter an email.")
-
-            st.markdown("#### Webhook (optional)")
-            settings = get_settings(workspace_id)
-            webhook_new = st.text_input("Webhook URL", value=settings.get("webhook_url",""), key="wh_thread")
-            if st.button("Save webhook", use_container_width=True):
-                s = get_settings(workspace_id)
-                upsert_settings(workspace_id, s["folders"], s["scoring_profile"], webhook_new.strip())
-                st.success("Saved.")
+    # Tracks its open state so the user list and admin widgets are only built while it's expanded.
+    admin_box = st.expander("Admin", expanded=False, key="admin_open", on_change="rerun")
+    with admin_box:
+        if admin_box.open:
+            st.caption("Roles + invites + webhooks (corporate-ready).")
+            if role != "admin":
+                st.info("You are an Analyst. Admin controls are locked in this POC.")
+            users_df = list_users(workspace_id)
+            st.dataframe(users_df, use_container_width=True, height=180)
+
+            if role == "admin":
+                st.markdown("#### Invitations")
+                inv_email = st.text_input("Invite email", value="", key="inv_email_thread")
+                inv_role = st.selectbox("Role", ["analyst","admin"], index=0, key="inv_role_thread")
+                if st.button("Generate invite", use_container_width=True, key="gen_inv_thread"):
+                    if inv_email.strip():
+                        code = upsert_invite(workspace_id, inv_email.strip(), inv_role)
+                        st.success("Invite created.")
+                        st.code(f"?invite={code}", language="text")
+                    else:
+                        st.warning("Enter an email.")
+
+                st.markdown("#### Webhook (optional)")
+                webhook_new = st.text_input("Webhook URL", value=settings.get("webhook_url",""), key="wh_thread")
+                if st.button("Save webhook", use_container_width=True):
+                    upsert_settings(workspace_id, settings["folders"], settings["scoring_profile"], webhook_new.strip())
+                    st.success("Saved.")
 
 # --- Main: Either open a saved thread or work on an imported draft ---
 active_id = st.session_state.get("active_deal_id")
@@ -1336,20 +2408,14 @@ if not active_memo and not draft_deal:
     st.stop()
 
 if draft_deal:
-    calib = get_calibration(workspace_id)
-    mi = st.session_state.get("draft_model_inputs") or {
-        "hold_years": 5, "rent_growth": 0.03, "expense_growth": 0.025,
-        "exit_cap": 0.065, "sale_cost_pct": 0.05,
-        "down_payment_pct": 0.25, "interest_rate": 0.065, "amort_years": 30
-    }
-    mi = apply_memory_defaults(workspace_id, draft_deal, mi)
+    calib = _calibration_for(workspace_id)
+    mi = st.session_state.get("draft_model_inputs") or dict(_DEFAULT_MODEL_INPUTS)
+    # Memory defaults only fill inputs that are missing (Import already applied them); skip the lookups otherwise.
+    if any(mi.get(k) is None for k, _ in _MODEL_INPUTS):
+        mi = apply_memory_defaults(workspace_id, draft_deal, mi)
     st.session_state["draft_model_inputs"] = mi
 
-    m = compute_metrics(draft_deal, calib)
-    model = build_cashflows(draft_deal, m, int(mi["hold_years"]), float(mi["rent_growth"]), float(mi["expense_growth"]),
-                            float(mi["exit_cap"]), float(mi["sale_cost_pct"]),
-                            float(mi["down_payment_pct"]), float(mi["interest_rate"]), int(mi["amort_years"]))
-    g = aire_grade(m, float(model["irr_annual"]), calib, scoring_profile)
+    m, model, g = _model_bundle(draft_deal, mi, calib, scoring_profile)
 
     memo_payload = {
         "deal": draft_deal, "metrics": m, "grade": g, "model": model,
@@ -1374,14 +2440,8 @@ with left:
     st.markdown(f"<div class='h2'>{'New deal' if mode=='draft' else 'Deal thread'}</div>", unsafe_allow_html=True)
     st.markdown(f"<div class='p'><b>{deal.get('address','')}</b></div>", unsafe_allow_html=True)
 
-    st.markdown(f'''
-    <div class="kpiRow">
-      <div class="kpi"><div class="label">Grade</div><div class="value">{g['letter']} <span class="small">({g['score']:.0f})</span></div></div>
-      <div class="kpi"><div class="label">IRR</div><div class="value">{model.get('irr_annual',0):.1%}</div></div>
-      <div class="kpi"><div class="label">Expense Ratio</div><div class="value">{m.get('oer',0):.1%}</div></div>
-      <div class="kpi"><div class="label">NOI</div><div class="value">${m.get('noi',0):,.0f}</div></div>
-    </div>
-    ''', unsafe_allow_html=True)
+    st.markdown(_KPI_TMPL.format(grade=g['letter'], score=g['score'], irr=model.get('irr_annual',0),
+                                 oer=m.get('oer',0), noi=m.get('noi',0)), unsafe_allow_html=True)
 
     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 
@@ -1389,7 +2449,7 @@ with left:
     _render_bubbles(st.session_state.chat)
 
     # Action chips under the assistant's last message
-    chips = suggest_action_chips(deal, mi, m, g, st.session_state.chat)
+    chips = suggest_action_chips(deal, mi, m, g)
     if chips:
         st.markdown("<div class='chipHint'><b>Quick actions</b> (one-click)</div>", unsafe_allow_html=True)
         cols = st.columns(min(len(chips), 5))
@@ -1397,7 +2457,7 @@ with left:
             with cols[i]:
                 if st.button(chip['label'], key=f"chip_{i}_{mode}", use_container_width=True):
                     st.session_state.chat.append({'role':'user','content': chip['command']})
-                    deal_updated, reply = apply_chat_update(chip['command'], dict(deal))
+                    deal_updated, reply = apply_chat_update(chip['command'], deal, metrics=m, mi=mi)
                     st.session_state.chat.append({'role':'assistant','content': reply})
                     if mode == 'draft':
                         st.session_state.deal = deal_updated
@@ -1418,7 +2478,7 @@ with left:
             with a_cols[i % 4]:
                 if st.button(a['label'], key=f"act_{i}_{mode}", use_container_width=True):
                     st.session_state.chat.append({'role':'user','content': a['command']})
-                    deal_updated, reply = apply_chat_update(a['command'], dict(deal))
+                    deal_updated, reply = apply_chat_update(a['command'], deal, metrics=m, mi=mi)
                     st.session_state.chat.append({'role':'assistant','content': reply})
                     if mode == 'draft':
                         st.session_state.deal = deal_updated
@@ -1440,7 +2500,7 @@ with left:
     user = st.chat_input("Message AIRE… (e.g., rent to 1750, vacancy to 9%)")
     if user:
         st.session_state.chat.append({"role":"user","content":user})
-        deal_updated, reply = apply_chat_update(user, dict(deal))
+        deal_updated, reply = apply_chat_update(user, deal, metrics=m, mi=mi)
         st.session_state.chat.append({"role":"assistant","content":reply})
         if mode == "draft":
             st.session_state.deal = deal_updated
@@ -1476,16 +2536,12 @@ with right:
     st.checkbox("Exit cap is defensible", value=False)
 
     if st.button("Re-run analysis", use_container_width=True):
-        calib = get_calibration(workspace_id)
+        calib = _calibration_for(workspace_id)
         if mode == "draft":
             dcur = st.session_state.get("deal") or dict(deal)
         else:
             dcur = st.session_state.get("saved_working_deal") or dict(deal)
-        m2 = compute_metrics(dcur, calib)
-        model2 = build_cashflows(dcur, m2, int(mi["hold_years"]), float(mi["rent_growth"]), float(mi["expense_growth"]),
-                                 float(mi["exit_cap"]), float(mi["sale_cost_pct"]),
-                                 float(mi["down_payment_pct"]), float(mi["interest_rate"]), int(mi["amort_years"]))
-        g2 = aire_grade(m2, float(model2["irr_annual"]), calib, scoring_profile)
+        m2, model2, g2 = _model_bundle(dcur, mi, calib, scoring_profile)
         memo_payload.update({"deal": dcur, "metrics": m2, "model": model2, "grade": g2, "model_inputs": mi, "chat": st.session_state.chat})
         if mode == "draft":
             st.session_state.deal = dcur
@@ -1495,8 +2551,13 @@ with right:
         st.rerun()
 
     st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
-    pdf = generate_memo_pdf_bytes(BRAND, ACCENT, st.session_state.brand_logo_b64, memo_payload)
-    st.download_button("Download memo (PDF)", data=pdf, file_name=f"{BRAND}_Memo_{slugify(deal.get('address','property'))}.pdf", use_container_width=True)
+    # Rendered on click, off the script thread (no session_state there): bind the logo and a snapshot of the memo now.
+    # The stamp is taken at click time.
+    pdf_args = (BRAND, ACCENT, st.session_state.brand_logo_b64, dict(memo_payload))
+    st.download_button("Download memo (PDF)",
+                       data=lambda args=pdf_args: generate_memo_pdf_bytes(*args, datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")),
+                       file_name=f"{BRAND}_Memo_{slugify(deal.get('address','property'))}.pdf", mime="application/pdf",
+                       use_container_width=True)
 
     if mode == "draft":
         st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
@@ -1510,6 +2571,9 @@ with right:
                             folder, slug, g["letter"], float(g["score"]), float(model["irr_annual"]), float(m["oer"]), float(m["noi"]),
                             {"memo": memo_payload})
             save_memo(workspace_id, st.session_state["email"], slug, memo_payload, BRAND, ACCENT)
+            post_webhook_async(webhook_url, {"event": "deal_saved", "workspace_id": workspace_id, "deal_id": did, "folder": folder,
+                                             "slug": slug, "address": deal.get("address", ""), "grade": g["letter"],
+                                             "score": float(g["score"]), "irr_annual": float(model["irr_annual"])})
             st.session_state.active_deal_id = did
             st.session_state.deal = None
             st.success(f"Saved. Opened thread #{did}.")
@@ -1520,21 +2584,20 @@ with right:
         if st.button("Update thread (new version)", use_container_width=True):
             update_memory_from_memo(workspace_id, memo_payload)
 
-            calib = get_calibration(workspace_id)
+            calib = _calibration_for(workspace_id)
             working = st.session_state.get("saved_working_memo") or memo_payload
             dcur = working["deal"]
-            m2 = compute_metrics(dcur, calib)
-            model2 = build_cashflows(dcur, m2, int(mi["hold_years"]), float(mi["rent_growth"]), float(mi["expense_growth"]),
-                                     float(mi["exit_cap"]), float(mi["sale_cost_pct"]),
-                                     float(mi["down_payment_pct"]), float(mi["interest_rate"]), int(mi["amort_years"]))
-            g2 = aire_grade(m2, float(model2["irr_annual"]), calib, scoring_profile)
+            m2, model2, g2 = _model_bundle(dcur, mi, calib, scoring_profile)
             working.update({"metrics": m2, "model": model2, "grade": g2, "model_inputs": mi, "chat": st.session_state.chat})
-            update_deal_latest(workspace_id, int(active_id), g2["letter"], float(g2["score"]), float(model2["irr_annual"]),
-                               float(m2["oer"]), float(m2["noi"]), {"memo": working})
-            vnum = next_version_num(workspace_id, int(active_id))
-            save_deal_version(workspace_id, int(active_id), vnum, "thread_update",
-                              g2["letter"], float(g2["score"]), float(model2["irr_annual"]), float(m2["oer"]), float(m2["noi"]), {"memo": working})
-            audit(workspace_id, st.session_state["email"], "deal_thread_updated", "deal", int(active_id), {"version": vnum})
+            with tx():
+                update_deal_latest(workspace_id, int(active_id), g2["letter"], float(g2["score"]), float(model2["irr_annual"]),
+                                   float(m2["oer"]), float(m2["noi"]), {"memo": working})
+                vnum = save_deal_version(workspace_id, int(active_id), "thread_update",
+                                         g2["letter"], float(g2["score"]), float(model2["irr_annual"]), float(m2["oer"]), float(m2["noi"]), {"memo": working})
+                audit(workspace_id, st.session_state["email"], "deal_thread_updated", "deal", int(active_id), {"version": vnum})
+            post_webhook_async(webhook_url, {"event": "deal_thread_updated", "workspace_id": workspace_id, "deal_id": int(active_id),
+                                             "version": vnum, "address": dcur.get("address", ""), "grade": g2["letter"],
+                                             "score": float(g2["score"]), "irr_annual": float(model2["irr_annual"])})
             st.success("Thread updated + versioned.")
             st.rerun()
 
@@ -0,0 +1,44 @@
+"""Load app.py's definitions without rendering the page, for tests of its data-layer helpers."""
+import ast
+import os
+from typing import Any, Dict
+
+import streamlit as st
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def _is_page_code(node: ast.AST) -> bool:
+    # The page's control flow, and any other statement touching st.* (widgets, session_state, page config).
+    if isinstance(node, (ast.FunctionDef, ast.Import, ast.ImportFrom, ast.Try)):
+        return False
+    if isinstance(node, (ast.With, ast.If, ast.For, ast.While)):
+        return True
+    return any(isinstance(n, ast.Attribute) and isinstance(n.value, ast.Name) and n.value.id == "st" for n in ast.walk(node))
+
+
+def load_app() -> Dict[str, Any]:
+    """Imports, functions, module constants and the _init_* / _warm_* setup calls of app.py, run in order.
+
+    Module-level assignments that depend on the page (settings = _settings_for(workspace_id), ...) are skipped.
+    DB_PATH is relative, so the database lands in the current directory. Process-wide caches are cleared first.
+    """
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), APP_PATH)
+    body = []
+    for node in tree.body:
+        if _is_page_code(node):
+            continue
+        if isinstance(node, ast.Expr) and not (isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name)
+                                               and node.value.func.id.startswith(("_init_db", "_warm_"))):
+            continue
+        if isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            if not all(isinstance(t, ast.Name) and (t.id.isupper() or t.id.startswith("_")) for t in targets):
+                continue
+        body.append(node)
+    ns: Dict[str, Any] = {"__name__": "aire_app", "__file__": APP_PATH}
+    exec(compile(ast.Module(body=body, type_ignores=[]), APP_PATH, "exec"), ns)
+    return ns
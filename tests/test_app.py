@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from app_loader import load_app
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+class AppTestCase(unittest.TestCase):
+    # Each test runs against a fresh aire.db in a temp dir; process-wide caches (connection pool, schema init)
+    # are cleared so nothing points at another test's database.
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        st.cache_data.clear()
+        st.cache_resource.clear()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def signed_in(self, email: str = "admin@example.com") -> AppTest:
+        at = AppTest.from_file(APP_PATH, default_timeout=60)
+        at.run()
+        next(t for t in at.sidebar.text_input if t.label == "Email").set_value(email).run()
+        self.assertFalse(at.exception)
+        return at
+
+
+class AdminExpanderTest(AppTestCase):
+    def test_admin_body_only_built_while_open(self):
+        at = self.signed_in()   # first user in the workspace is an admin
+        self.assertNotIn("wh_thread", [t.key for t in at.text_input])
+
+        at.session_state["admin_open"] = True
+        at.run()
+        self.assertFalse(at.exception)
+        self.assertIn("wh_thread", [t.key for t in at.text_input])
+        self.assertIn("Save webhook", [b.label for b in at.button])
+
+        at.session_state["admin_open"] = False
+        at.run()
+        self.assertNotIn("wh_thread", [t.key for t in at.text_input])
+
+
+class BatchImportTest(AppTestCase):
+    def test_batch_demo_matches_single(self):
+        app = load_app()
+        links = ["123 Main St", "https://example.com/listing/42", " 9 Oak Ave ", "", "a" * 300]
+        self.assertEqual(app["demo_listings_from_links"](links), [app["demo_listing_from_link"](l) for l in links])
+        self.assertEqual(app["demo_listings_from_links"]([]), [])
+
+    def test_multi_line_paste_saves_a_thread_per_link(self):
+        at = self.signed_in()
+        at.sidebar.text_area(key="thread_import_link").set_value("123 Main St\n\n9 Oak Ave\n77 Elm Rd\n").run()
+        next(b for b in at.sidebar.button if b.label == "Import").click().run()
+        self.assertFalse(at.exception)
+        self.assertEqual(len([b for b in at.sidebar.button if b.key and b.key.startswith("open_")]), 3)
+
+
+class ThreadListTest(AppTestCase):
+    def test_new_search_resets_paging(self):
+        at = self.signed_in()
+        at.sidebar.text_area(key="thread_import_link").set_value("\n".join(f"{n} Main St" for n in range(45))).run()
+        next(b for b in at.sidebar.button if b.label == "Import").click().run()
+        at.sidebar.button(key="thread_more").click().run()
+        self.assertEqual(at.session_state["thread_limit"], 80)
+
+        next(t for t in at.sidebar.text_input if t.label == "Search").set_value("main").run()
+        self.assertFalse(at.exception)
+        self.assertEqual(at.session_state["thread_limit"], 40)
+
+
+class MemoPdfTest(AppTestCase):
+    def test_stamp_is_swapped_into_the_cached_body(self):
+        app = load_app()
+        deal = app["demo_listing_from_link"]("123 Main St")
+        mi = dict(app["_DEFAULT_MODEL_INPUTS"])
+        m, model, g = app["_model_bundle"](deal, mi, {"vacancy_bias": 0.0, "oer_bias": 0.0, "irr_bias": 0.0}, "Core")
+        memo = {"deal": deal, "metrics": m, "grade": g, "model": model, "model_inputs": mi}
+
+        first = app["generate_memo_pdf_bytes"]("AIRE", "#2563eb", "", memo, "2026-01-02 03:04 UTC")
+        second = app["generate_memo_pdf_bytes"]("AIRE", "#2563eb", "", memo, "2026-01-02 03:05 UTC")
+        self.assertIn(b"Generated: 2026-01-02 03:04 UTC", first)
+        self.assertIn(b"Generated: 2026-01-02 03:05 UTC", second)
+        self.assertEqual(len(first), len(second))
+        self.assertEqual(first.replace(b"03:04 UTC", b"03:05 UTC"), second)
+
+
+class AuditFlushTest(AppTestCase):
+    def test_failed_flush_keeps_rows_and_rearms(self):
+        app = load_app()
+        db = sqlite3.connect(app["DB_PATH"])
+        self.addCleanup(db.close)
+        db.execute("ALTER TABLE audit_log RENAME TO audit_log_away")
+        db.commit()
+        app["audit"](1, "a@b.com", "first")
+        app["audit"](1, "a@b.com", "second")
+        with self.assertRaises(sqlite3.OperationalError):
+            app["flush_audit"]()
+        self.assertEqual([r[2] for r in app["_audit_buffer"]], ["first", "second"])
+        self.assertIsNotNone(app["_AUDIT"]["timer"])
+
+        app["_AUDIT"]["timer"].cancel()
+        db.execute("ALTER TABLE audit_log_away RENAME TO audit_log")
+        db.commit()
+        app["flush_audit"]()
+        self.assertFalse(app["_audit_buffer"])
+        self.assertEqual([r[0] for r in db.execute("SELECT action FROM audit_log ORDER BY id")][-2:], ["first", "second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import copy
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from app_loader import load_app
+
+
+class DealVersionsTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self.app = load_app()
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def _memo(self):
+        return {"deal": {"address": "9 Oak Ave", "price": 500000},
+                "model": {"cashflows": [float(x) for x in range(61)], "irr_annual": 0.1},
+                "chat": [{"role": "assistant", "content": "Imported. " + "x" * 200}]}
+
+    def _save(self, deal_id, memo):
+        vnum = self.app["save_deal_version"](1, deal_id, "thread_update", "B", 80.0, 0.1, 0.4, 1000.0, {"memo": memo})
+        return vnum, self.app["_loads"](self.app["_dumps"]({"memo": memo}))
+
+    def _db(self):
+        db = sqlite3.connect(self.app["DB_PATH"])
+        self.addCleanup(db.close)
+        return db
+
+    def _stored_kinds(self, deal_id):
+        rows = sqlite3.connect(self.app["DB_PATH"]).execute(
+            "SELECT version_num, payload FROM deal_versions WHERE deal_id=? ORDER BY version_num", (deal_id,)).fetchall()
+        return {v: "patch" in self.app["_unpack"](blob) for v, blob in rows}
+
+    def _new_deal(self, memo):
+        return self.app["save_deal"](1, "a@b.com", "demo", "9 Oak Ave", "Maybe", "s", "B", 80.0, 0.1, 0.4, 1000.0, {"memo": memo})
+
+    def test_round_trip_across_snapshots(self):
+        memo = self._memo()
+        deal_id = self._new_deal(memo)
+        expected = {1: self.app["_loads"](self.app["_dumps"]({"memo": memo}))}
+        for v in range(2, 26):
+            memo = copy.deepcopy(memo)
+            memo["chat"].append({"role": "user", "content": f"rent to {1500 + v}"})
+            memo["deal"]["price"] += 1000
+            vnum, expected[v] = self._save(deal_id, memo)
+            self.assertEqual(vnum, v)
+
+        for v, payload in expected.items():
+            self.assertEqual(self.app["get_version_payload"](1, deal_id, v), payload, f"version {v}")
+        kinds = self._stored_kinds(deal_id)
+        self.assertTrue(any(kinds.values()))                   # deltas were stored and replayed
+        self.assertFalse(kinds[1] or kinds[11] or kinds[21])   # forced snapshots
+
+    def test_versions_in_one_tx_get_distinct_numbers(self):
+        memo = self._memo()
+        deal_id = self._new_deal(memo)
+        with self.app["tx"]():
+            first, _ = self._save(deal_id, memo)
+            second, last = self._save(deal_id, memo)
+        self.assertEqual((first, second), (2, 3))
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 3), last)
+        with self.assertRaises(sqlite3.IntegrityError):
+            db = self._db()
+            db.execute("INSERT INTO deal_versions (workspace_id, deal_id, version_num, reason, created_at, payload) "
+                       "VALUES (1, ?, 3, 'x', 'now', x'')", (deal_id,))
+
+    def test_gap_stores_snapshot(self):
+        memo = self._memo()
+        deal_id = self._new_deal(memo)
+        for v in (2, 3, 4, 5):
+            memo = copy.deepcopy(memo)
+            memo["chat"].append({"role": "user", "content": f"vacancy to {v}%"})
+            self._save(deal_id, memo)
+        db = self._db()
+        db.execute("DELETE FROM deal_versions WHERE deal_id=? AND version_num=4", (deal_id,))   # 5's base
+        db.commit()
+        vnum, last = self._save(deal_id, memo)
+
+        self.assertEqual(vnum, 6)
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 5), {})
+        self.assertFalse(self._stored_kinds(deal_id)[6])
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 6), last)
+
+    def test_unappliable_delta_stores_snapshot(self):
+        memo = self._memo()
+        deal_id = self._new_deal(memo)
+        for v in (2, 3):
+            memo = copy.deepcopy(memo)
+            memo["chat"].append({"role": "user", "content": f"insurance to {v}000"})
+            self._save(deal_id, memo)
+        self.assertTrue(self._stored_kinds(deal_id)[3])
+        db = self._db()
+        bad = self.app["_pack"]({"patch": [{"op": "remove", "path": "/memo/nope"}], "base_version": 2})
+        db.execute("UPDATE deal_versions SET payload=? WHERE deal_id=? AND version_num=3", (bad, deal_id))
+        db.commit()
+
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 3), {})
+        vnum, last = self._save(deal_id, memo)
+        self.assertEqual(vnum, 4)
+        self.assertFalse(self._stored_kinds(deal_id)[4])
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 4), last)
+
+    def test_missing_base_is_not_replayed_onto_an_older_version(self):
+        memo = self._memo()
+        deal_id = self._new_deal(memo)
+        for v in (2, 3, 4):
+            memo = copy.deepcopy(memo)
+            memo["chat"].append({"role": "user", "content": f"taxes to {v}000"})
+            self._save(deal_id, memo)
+        self.assertTrue(self._stored_kinds(deal_id)[4])
+        db = self._db()
+        db.execute("DELETE FROM deal_versions WHERE deal_id=? AND version_num=3", (deal_id,))
+        db.commit()
+
+        self.assertEqual(self.app["get_version_payload"](1, deal_id, 4), {})
+
+
+if __name__ == "__main__":
+    unittest.main()